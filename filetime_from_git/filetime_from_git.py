@@ -2,17 +2,278 @@
 # -*- coding: utf-8 -*-
 
 import os
-from git import Git, Repo, InvalidGitRepositoryError
+import re
+import json
+import logging
+import threading
+from subprocess import Popen, PIPE
 from pelican import signals, contents
 from datetime import datetime
-from time import mktime, altzone
 from pelican.utils import strftime, set_date_tzinfo
 
-try:
-    repo = Repo(os.path.abspath('.'))
-    git = Git(os.path.abspath('.'))
-except InvalidGitRepositoryError as e:
-    repo = None
+logger = logging.getLogger(__name__)
+
+# settings['PATH'] -> GitTimes of the current build
+_git_times = {}
+
+# marks the commit header in the ``git log`` output, see ``git_log_tokens``
+COMMIT_MARKER = '\x01'
+STATUS_RE = re.compile(r'^[ACDMRTUXB][0-9]*$')
+
+
+def run_git(cwd, *args):
+    """Run a git command in ``cwd`` and return its status and output."""
+    try:
+        process = Popen(('git',) + args, cwd=cwd, stdout=PIPE, stderr=PIPE)
+    except OSError:
+        # git is not installed
+        return 1, ''
+    stdout, stderr = process.communicate()
+    return process.returncode, stdout.decode('utf-8')
+
+
+def git_log_tokens(root, revision_range='HEAD'):
+    """
+    Yield the NUL separated tokens of a single ``git log --name-status``
+    pass over ``revision_range`` of the repository at ``root``.
+    """
+    process = Popen(['git', 'log', '-z', '-M', '--date-order', '--name-status',
+                     '--format=%x01%ct', revision_range, '--'],
+                    cwd=root, stdout=PIPE)
+    pending = b''
+    for chunk in iter(lambda: process.stdout.read(65536), b''):
+        pending += chunk
+        tokens = pending.split(b'\0')
+        pending = tokens.pop()
+        for token in tokens:
+            yield token.decode('utf-8').lstrip('\n')
+    if pending:
+        yield pending.decode('utf-8').lstrip('\n')
+    process.stdout.close()
+    process.wait()
+
+
+def build_history(tokens):
+    """
+    Map every path that exists at HEAD to the timestamps of its first and
+    last commit, following renames.
+
+    The log is walked newest first. ``alias`` maps a historical path to the
+    path it has at HEAD, or to None when older commits touching it belong to
+    another file (it was deleted, or created by the commit being walked).
+    Both maps are returned, paths are relative to the repository root.
+    """
+    history = {}
+    alias = {}
+    timestamp = None
+    tokens = iter(tokens)
+
+    def touch(path):
+        if path is None:
+            return
+        first, last = history.get(path, (timestamp, timestamp))
+        history[path] = (min(first, timestamp), max(last, timestamp))
+
+    for token in tokens:
+        if not token:
+            continue
+        if token.startswith(COMMIT_MARKER):
+            timestamp = int(token[len(COMMIT_MARKER):])
+            continue
+        if not STATUS_RE.match(token):
+            continue
+        status = token[0]
+        path = next(tokens)
+        if status in 'RC':
+            new_path = next(tokens)
+            current = alias.get(new_path, new_path)
+            touch(current)
+            alias[new_path] = None
+            if status == 'R':
+                alias[path] = current
+        elif status == 'D':
+            alias.setdefault(path, None)
+        else:
+            current = alias.get(path, path)
+            touch(current)
+            if status == 'A':
+                alias[path] = None
+
+    return history, alias
+
+
+def merge_history(history, alias, older):
+    """
+    Merge the ``older`` index of a previous build into ``history`` walked
+    from the commits since, moving entries of renamed or deleted paths
+    according to ``alias``.
+    """
+    for path, (first, last) in older.items():
+        current = alias.get(path, path)
+        if current is None:
+            continue
+        if current in history:
+            newer_first, newer_last = history[current]
+            history[current] = (min(first, newer_first), max(last, newer_last))
+        else:
+            history[current] = (first, last)
+    return history
+
+
+def load_history_cache(cache_file):
+    try:
+        with open(cache_file) as fd:
+            cache = json.load(fd)
+        return cache['head'], cache['history']
+    except (IOError, OSError, ValueError, KeyError) as e:
+        if os.path.exists(cache_file):
+            logger.warning('filetime_from_git: ignoring cache %s: %s',
+                           cache_file, e)
+        return None, {}
+
+
+def save_history_cache(cache_file, head, history):
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    with open(cache_file, 'w') as fd:
+        json.dump({'head': head, 'history': history}, fd)
+
+
+def read_history(root, cache_file):
+    """
+    Return the history index of the repository at ``root``.
+
+    When ``cache_file`` holds the index of an ancestor of HEAD, only the
+    commits since are walked and merged into it; the updated index is
+    written back tagged with the current HEAD.
+    """
+    status, head = run_git(root, 'rev-parse', '--verify', 'HEAD')
+    if status != 0:
+        # no commits yet
+        return {}
+    head = head.strip()
+
+    cached_head, cached_history = None, {}
+    if cache_file:
+        cached_head, cached_history = load_history_cache(cache_file)
+
+    if cached_head == head:
+        history = cached_history
+    elif cached_head is not None and run_git(
+            root, 'merge-base', '--is-ancestor', cached_head, head)[0] == 0:
+        history, alias = build_history(
+            git_log_tokens(root, cached_head + '..' + head))
+        history = merge_history(history, alias, cached_history)
+    else:
+        history, alias = build_history(git_log_tokens(root, head))
+
+    if cache_file and cached_head != head:
+        save_history_cache(cache_file, head, history)
+    return history
+
+
+def git_status(root):
+    """
+    Return the sets of dirty, staged and untracked paths of the work tree
+    at ``root`` from a single ``git status --porcelain -z`` call.
+    """
+    status, stdout = run_git(root, 'status', '--porcelain', '-z',
+                             '--untracked-files=all')
+    dirty, staged, untracked = set(), set(), set()
+    entries = iter(stdout.split('\0'))
+    for entry in entries:
+        if not entry:
+            continue
+        index, work_tree, path = entry[0], entry[1], entry[3:]
+        if index in 'RC':
+            # the source path of a rename or copy follows as its own entry
+            next(entries)
+        path = os.path.join(root, path)
+        if index == '?':
+            untracked.add(path)
+            continue
+        if index != ' ':
+            staged.add(path)
+        if work_tree != ' ':
+            dirty.add(path)
+    return dirty, staged, untracked
+
+
+def find_repo_root(path):
+    """Return the root of the git work tree containing ``path``, or None."""
+    status, root = run_git(path, 'rev-parse', '--show-toplevel')
+    if status != 0:
+        return None
+    return os.path.realpath(root.strip())
+
+
+class GitTimes(object):
+    """
+    Commit time index and work tree status of the repository holding the
+    content at ``settings['PATH']``.
+
+    Everything is read in a background thread, so that git runs while
+    Pelican reads the content; ``wait`` joins it on first lookup.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.root = None
+        self.history = {}
+        self.dirty = self.staged = self.untracked = frozenset()
+        self.thread = threading.Thread(target=self.load)
+        self.thread.daemon = True
+        self.error = None
+
+    def load(self):
+        try:
+            root = find_repo_root(self.settings['PATH'])
+            if root is None:
+                return
+            cache_file = None
+            if self.settings.get('FILETIME_FROM_GIT_CACHE', True):
+                cache_file = os.path.join(
+                    self.settings.get('CACHE_PATH', 'cache'),
+                    'filetime_from_git.json')
+            self.dirty, self.staged, self.untracked = git_status(root)
+            self.history = dict(
+                (os.path.join(root, path), tuple(times))
+                for path, times in read_history(root, cache_file).items())
+            self.root = root
+        except Exception as e:
+            self.error = e
+
+    def start(self):
+        self.thread.start()
+
+    def wait(self):
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.error is not None:
+            logger.warning('filetime_from_git: could not read git history: %s',
+                           self.error)
+            self.error = None
+        return self
+
+
+def get_git_times(settings):
+    """Return the started ``GitTimes`` for the content at settings['PATH']."""
+    path = settings['PATH']
+    if path not in _git_times:
+        _git_times[path] = GitTimes(settings)
+        _git_times[path].start()
+    return _git_times[path]
+
+
+def start_git_times(pelican):
+    get_git_times(pelican.settings)
+
+
+def reset_git_times(pelican):
+    # the next build (e.g. with --autoreload) has to see new commits
+    _git_times.pop(pelican.settings['PATH'], None)
+
 
 def datetime_from_timestamp(timestamp, content):
     """
@@ -23,7 +284,7 @@ def datetime_from_timestamp(timestamp, content):
     return set_date_tzinfo(datetime.fromtimestamp(timestamp), tz_name=content.settings.get('TIMEZONE', None))
 
 def filetime_from_git(content):
-    if isinstance(content, contents.Static) or repo is None:
+    if isinstance(content, contents.Static):
         return
     gittime = content.metadata.get('gittime', 'yes').lower()
     gittime = gittime.replace("false", "no").replace("off", "no")
@@ -37,31 +298,26 @@ def filetime_from_git(content):
     #    date: first commit time, update: last commit time or None
     # 4. file is managed, but dirty
     #    date: first commit time, update: fs time
+    git_times = get_git_times(content.settings).wait()
+    if git_times.root is None:
+        return
     path = content.source_path
-    status, stdout, stderr = git.execute(['git', 'ls-files', path, '--error-unmatch'],
-            with_extended_output=True, with_exceptions=False)
-    if status != 0:
-        # file is not managed by git
+    real_path = os.path.realpath(path)
+    times = git_times.history.get(real_path)
+    if times is None:
+        # file is not managed by git, or never commited but staged
         content.date = datetime_from_timestamp(os.stat(path).st_ctime, content)
     else:
-        # file is managed by git
-        commits = repo.commits(path=path)
-        if len(commits) == 0:
-            # never commited, but staged
-            content.date = datetime_from_timestamp(os.stat(path).st_ctime, content)
+        # has commited
+        first, last = times
+        content.date = datetime_from_timestamp(first, content)
+
+        if real_path in git_times.dirty or real_path in git_times.staged:
+            # file has changed
+            content.modified = datetime_from_timestamp(os.stat(path).st_ctime, content)
         else:
-            # has commited
-            content.date = datetime_from_timestamp(mktime(commits[-1].committed_date) - altzone, content)
-
-            status, stdout, stderr = git.execute(['git', 'diff', '--quiet', 'HEAD', path],
-                    with_extended_output=True, with_exceptions=False)
-            if status != 0:
-                # file has changed
-                content.modified = datetime_from_timestamp(os.stat(path).st_ctime, content)
-            else:
-                # file is not changed
-                if len(commits) > 1:
-                    content.modified = datetime_from_timestamp(mktime(commits[0].committed_date) - altzone, content)
+            # file is not changed
+            content.modified = datetime_from_timestamp(last, content)
     if not hasattr(content, 'modified'):
         content.modified = content.date
     if hasattr(content, 'date'):
@@ -70,4 +326,6 @@ def filetime_from_git(content):
         content.locale_modified = strftime(content.modified, content.date_format)
 
 def register():
+    signals.initialized.connect(start_git_times)
     signals.content_object_init.connect(filetime_from_git)
+    signals.finalized.connect(reset_git_times)
@@ -0,0 +1,194 @@
+import os
+import shutil
+import importlib
+import tempfile
+import unittest
+from subprocess import check_call
+
+from .filetime_from_git import (build_history, git_log_tokens, git_status,
+                                load_history_cache, read_history, run_git)
+
+# the package exports the filetime_from_git function under the same name
+module = importlib.import_module('.filetime_from_git', __package__)
+
+
+@unittest.skipIf(run_git('.', '--version')[0] != 0, 'git is not installed')
+class GitRepoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.git('init', '-q')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def git(self, *args, **env):
+        env = dict(os.environ, GIT_CONFIG_NOSYSTEM='1', **env)
+        check_call(('git', '-c', 'user.name=Test', '-c', 'user.email=t@t',
+                    '-c', 'commit.gpgsign=false') + args,
+                   cwd=self.root, env=env)
+
+    def write(self, path, text):
+        with open(os.path.join(self.root, path), 'w') as f:
+            f.write(text)
+
+    def commit(self, timestamp, *paths):
+        """Stage ``paths`` (all changes by default) and commit them"""
+        self.git('add', '-A', *paths)
+        date = '@{0} +0000'.format(timestamp)
+        self.git('commit', '-q', '-m', str(timestamp),
+                 GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+
+    def history(self):
+        return build_history(git_log_tokens(self.root))[0]
+
+
+class TestHistory(GitRepoTestCase):
+
+    def test_add_and_modify(self):
+        self.write('a.md', 'a\n')
+        self.commit(100)
+        self.write('a.md', 'a\nb\n')
+        self.commit(200)
+        self.write('b.md', 'b\n')
+        self.commit(300)
+        self.assertEqual(self.history(), {'a.md': (100, 200),
+                                          'b.md': (300, 300)})
+
+    def test_rename(self):
+        self.write('a.md', 'some text\n' * 10)
+        self.commit(100)
+        self.git('mv', 'a.md', 'b.md')
+        self.commit(200)
+        self.write('b.md', 'some text\n' * 11)
+        self.commit(300)
+        self.assertEqual(self.history(), {'b.md': (100, 300)})
+
+    def test_new_file_at_renamed_path(self):
+        self.write('a.md', 'some text\n' * 10)
+        self.commit(100)
+        self.git('mv', 'a.md', 'b.md')
+        self.commit(200)
+        self.write('a.md', 'another file\n')
+        self.commit(300)
+        self.assertEqual(self.history(), {'a.md': (300, 300),
+                                          'b.md': (100, 200)})
+
+    def test_deleted_then_added_again(self):
+        self.write('a.md', 'a\n')
+        self.write('b.md', 'b\n')
+        self.commit(100)
+        self.git('rm', '-q', 'a.md')
+        self.commit(200)
+        self.write('a.md', 'new a\n')
+        self.commit(300)
+        self.assertEqual(self.history(), {'a.md': (300, 300),
+                                          'b.md': (100, 100)})
+
+    def test_subdirectories_and_spaces(self):
+        os.mkdir(os.path.join(self.root, 'sub dir'))
+        self.write(os.path.join('sub dir', 'a b.md'), 'a\n')
+        self.commit(100)
+        self.assertEqual(self.history(),
+                         {os.path.join('sub dir', 'a b.md'): (100, 100)})
+
+
+class TestStatus(GitRepoTestCase):
+
+    def paths(self, *names):
+        return set(os.path.join(self.root, name) for name in names)
+
+    def test_status(self):
+        for name in ['clean.md', 'dirty.md', 'staged.md', 'both.md',
+                     'moved.md']:
+            self.write(name, name * 10 + '\n')
+        self.commit(100)
+        self.write('dirty.md', 'changed\n')
+        self.write('staged.md', 'changed\n')
+        self.write('both.md', 'changed\n')
+        self.git('add', 'staged.md', 'both.md')
+        self.write('both.md', 'changed again\n')
+        self.git('mv', 'moved.md', 'renamed.md')
+        self.write('untracked.md', 'new\n')
+        dirty, staged, untracked = git_status(self.root)
+        self.assertEqual(dirty, self.paths('dirty.md', 'both.md'))
+        self.assertEqual(staged,
+                         self.paths('staged.md', 'both.md', 'renamed.md'))
+        self.assertEqual(untracked, self.paths('untracked.md'))
+
+
+class TestIncrementalHistory(GitRepoTestCase):
+
+    def setUp(self):
+        super(TestIncrementalHistory, self).setUp()
+        self.cache_path = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_path, 'history.json')
+        for name in ['kept.md', 'changed.md', 'moved.md', 'deleted.md']:
+            self.write(name, name * 10 + '\n')
+        self.commit(100)
+        self.write('changed.md', 'first change\n')
+        self.commit(200)
+        self.cached_head = self.head()
+        read_history(self.root, self.cache_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_path)
+        super(TestIncrementalHistory, self).tearDown()
+
+    def head(self):
+        return run_git(self.root, 'rev-parse', 'HEAD')[1].strip()
+
+    def read_history(self):
+        """Read the history with the cache, return it and the walked range"""
+        ranges = []
+
+        def recording_git_log_tokens(root, revision_range='HEAD'):
+            ranges.append(revision_range)
+            return git_log_tokens(root, revision_range)
+
+        module.git_log_tokens = recording_git_log_tokens
+        try:
+            history = read_history(self.root, self.cache_file)
+        finally:
+            module.git_log_tokens = git_log_tokens
+        return history, ranges
+
+    def test_new_commits_are_merged(self):
+        self.write('changed.md', 'second change\n')
+        self.git('mv', 'moved.md', 'renamed.md')
+        self.git('rm', '-q', 'deleted.md')
+        self.write('added.md', 'added\n')
+        self.commit(300)
+        self.write('deleted.md', 'added again\n')
+        self.commit(400)
+        history, ranges = self.read_history()
+        self.assertEqual(ranges, [self.cached_head + '..' + self.head()])
+        self.assertEqual(history, read_history(self.root, None))
+        self.assertEqual(history, {'kept.md': (100, 100),
+                                   'changed.md': (100, 300),
+                                   'renamed.md': (100, 300),
+                                   'added.md': (300, 300),
+                                   'deleted.md': (400, 400)})
+        head, cached = load_history_cache(self.cache_file)
+        self.assertEqual(head, self.head())
+        self.assertEqual(dict((path, tuple(times))
+                              for path, times in cached.items()), history)
+
+    def test_rewritten_history(self):
+        # the cached HEAD is no ancestor of the amended commit
+        self.write('kept.md', 'amended\n')
+        self.git('add', 'kept.md')
+        date = '@300 +0000'
+        self.git('commit', '-q', '--amend', '-m', 'amended',
+                 GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+        history, ranges = self.read_history()
+        self.assertEqual(ranges, [self.head()])
+        self.assertEqual(history, read_history(self.root, None))
+        self.assertEqual(history, {'kept.md': (100, 300),
+                                   'changed.md': (100, 300),
+                                   'moved.md': (100, 100),
+                                   'deleted.md': (100, 100)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,8 +24,15 @@ SOFTWARE.
 """
 
 import os
+import sys
+import copy
+import json
+import shutil
+import hashlib
 import logging
-from collections import OrderedDict
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from pelican import signals, contents, generators, utils, readers
 
@@ -48,57 +55,218 @@ HIPAGE_LANG_URL = HIPAGE_LANG_SAVE_AS = "{hierarchy}-{lang}.html"
 
 
 
-def ascii_tree(tree, print_item=repr, prefix=[], last_prefix=""):
+def iter_ascii_tree(tree, print_item=repr, prefix=(), last_prefix=""):
     """
-    Print a nice ASCII tree of the iterable `tree`.
+    Yield the lines (without newline) of a nice ASCII tree of the iterable
+    `tree`, walking it iteratively.
 
     To print each item, the `print_item` callable is used and has to
     return a `str`.
     """
-    s = "".join(prefix[:-1]) + last_prefix + print_item(tree) + "\n"
-    try:
-        last_i = len(tree) - 1
-        for i, item in enumerate(tree):
+    # (item, indent of its line, indent of the lines of its children,
+    #  last_prefix)
+    stack = [(tree, "".join(prefix[:-1]), "".join(prefix), last_prefix)]
+    while stack:
+        item, indent, child_indent, last_prefix = stack.pop()
+        yield indent + last_prefix + print_item(item)
+        try:
+            children = list(item)
+        except TypeError:
+            continue
+        last_i = len(children) - 1
+        for i in range(last_i, -1, -1):
             if i == last_i:
-                s += ascii_tree(item,
-                                prefix=prefix + ["    "],
-                                last_prefix="└── ",
-                                print_item=print_item)
+                stack.append((children[i], child_indent,
+                              child_indent + "    ", "└── "))
             else:
-                s += ascii_tree(item,
-                                prefix=prefix + ["│   "],
-                                last_prefix="├── ",
-                                print_item=print_item)
-    except TypeError:
-        pass
-    return s
+                stack.append((children[i], child_indent,
+                              child_indent + "│   ", "├── "))
+
+
+def ascii_tree(tree, print_item=repr, prefix=(), last_prefix=""):
+    """
+    Print a nice ASCII tree of the iterable `tree`.
+
+    To print each item, the `print_item` callable is used and has to
+    return a `str`.
+    """
+    return "".join(line + "\n" for line in iter_ascii_tree(
+        tree, print_item=print_item, prefix=prefix, last_prefix=last_prefix))
+
+
+def write_ascii_tree(tree, stream, print_item=repr):
+    """Write the ASCII tree of `tree` line by line to `stream`."""
+    for line in iter_ascii_tree(tree, print_item=print_item):
+        stream.write(line + "\n")
 
 
 class CopyStaticAssetsGenerator(generators.Generator):
 
-    """Copy files (with certain extensions) to the `output_path`."""
+    """
+    Copy files (with certain extensions) to the `output_path`.
+
+    By default every asset is copied on every build. Settings for
+    incremental builds:
+
+    `HIERARCHY_STATIC_CHECK_IF_MODIFIED`: `'mtime'` to skip assets whose
+        output has the same size and modification time, `'digest'` to
+        compare the contents of same-sized files instead. Digests are
+        cached in `CACHE_PATH` while the size and modification time of a
+        file do not change.
+    `HIERARCHY_STATIC_LINKS`: `'hardlink'` or `'reflink'` (copy-on-write
+        clone, Linux only) instead of copying. Falls back to copying e.g.
+        if the output is on another filesystem.
+    `HIERARCHY_STATIC_REMOVE_ORPHANS`: remove the outputs of assets that
+        were copied by the previous build but no longer exist. The list
+        of copied outputs is kept in `CACHE_PATH`.
+    """
 
     def generate_output(self, writer):
-        self._generate_output_for(writer, 'ARTICLE')
-        self._generate_output_for(writer, 'PAGE')
-
-    def _generate_output_for(self, writer, kind):
         extensions = list(STATIC_EXTENSIONS)
         extensions.extend([ext.upper() for ext in STATIC_EXTENSIONS])
         if 'STATIC_EXTENSIONS' in self.settings:
             extensions.extend(self.settings['STATIC_EXTENSIONS'])
+        self.extensions = tuple(extensions)
+
+        self.copied_outputs = set()
+        check = self.settings.get('HIERARCHY_STATIC_CHECK_IF_MODIFIED')
+        self.previous_digests = {}
+        if check == 'digest':
+            self.previous_digests = self._load_cache(
+                'hierarchy_static_digests.json', {})
+        self.digests = {}
+        self._generate_output_for(writer, 'ARTICLE')
+        self._generate_output_for(writer, 'PAGE')
+        if check == 'digest':
+            self._save_cache('hierarchy_static_digests.json', self.digests)
+        if self.settings.get('HIERARCHY_STATIC_REMOVE_ORPHANS', False):
+            self._remove_orphans()
 
+    def _generate_output_for(self, writer, kind):
         for f in self.get_files(
                 self.settings[kind + '_PATHS'],
                 exclude=self.settings[kind + '_EXCLUDES'],
-                extensions=tuple(extensions)):
+                extensions=self.extensions):
             # hack, remove "pages/" and put the HiPages directly
             # in the root, instead
             t = f
             if f.startswith("pages/"):
                 t = f.split("pages/")[1]
-            utils.copy(os.path.join(self.path, f),
-                       os.path.join(self.output_path, t.lower()))
+            destination = os.path.join(self.output_path, t.lower())
+            self.copied_outputs.add(destination)
+            self._copy_asset(os.path.join(self.path, f), destination)
+
+    def _copy_asset(self, source, destination):
+        check = self.settings.get('HIERARCHY_STATIC_CHECK_IF_MODIFIED')
+        link = self.settings.get('HIERARCHY_STATIC_LINKS')
+        if not check and not link:
+            utils.copy(source, destination)
+            return
+        if check and _is_up_to_date(source, destination, check, self._digest):
+            logger.debug("Skipping unmodified asset {}".format(source))
+            return
+        self._write_asset(source, destination, link)
+        if source in self.digests:
+            # the output has the content of the source from now on
+            stat = os.stat(destination)
+            self.digests[destination] = [stat.st_size, stat.st_mtime,
+                                         self.digests[source][2]]
+
+    def _write_asset(self, source, destination, link):
+        destination_dir = os.path.dirname(destination)
+        if not os.path.isdir(destination_dir):
+            os.makedirs(destination_dir)
+        if os.path.lexists(destination):
+            # never write through an old hardlink into the source
+            os.remove(destination)
+        if link == 'hardlink':
+            try:
+                os.link(source, destination)
+                return
+            except OSError as e:
+                logger.debug("Cannot hardlink {}, copying it: {}".format(
+                    source, e))
+        elif link == 'reflink':
+            try:
+                _reflink(source, destination)
+                return
+            except (ImportError, IOError, OSError) as e:
+                logger.debug("Cannot reflink {}, copying it: {}".format(
+                    source, e))
+                if os.path.lexists(destination):
+                    os.remove(destination)
+        shutil.copy2(source, destination)
+
+    def _digest(self, path, stat):
+        """Digest of `path`, reused from the previous build if its size and
+        modification time (given by `stat`) did not change."""
+        key = [stat.st_size, stat.st_mtime]
+        cached = self.previous_digests.get(path)
+        if cached is None or cached[:2] != key:
+            cached = key + [_file_digest(path)]
+        self.digests[path] = cached
+        return cached[2]
+
+    def _remove_orphans(self):
+        previous = set(self._load_cache('hierarchy_static_assets.json', []))
+        for orphan in sorted(previous - self.copied_outputs):
+            if os.path.isfile(orphan):
+                logger.info("Removing orphaned asset {}".format(orphan))
+                os.remove(orphan)
+        self._save_cache('hierarchy_static_assets.json',
+                         sorted(self.copied_outputs))
+
+    def _load_cache(self, name, default):
+        try:
+            with open(os.path.join(self.settings['CACHE_PATH'], name)) as fd:
+                return json.load(fd)
+        except (IOError, OSError, ValueError):
+            return default
+
+    def _save_cache(self, name, data):
+        if not os.path.isdir(self.settings['CACHE_PATH']):
+            os.makedirs(self.settings['CACHE_PATH'])
+        with open(os.path.join(self.settings['CACHE_PATH'], name), 'w') as fd:
+            json.dump(data, fd)
+
+
+def _is_up_to_date(source, destination, check, digest=None):
+    """
+    Whether `destination` is a current copy of `source`, comparing size and
+    modification time (`check == 'mtime'`) or size and content
+    (`check == 'digest'`). `digest(path, stat)` gets the digest of a file,
+    by default it is computed from its content.
+    """
+    try:
+        destination_stat = os.stat(destination)
+    except OSError:
+        return False
+    source_stat = os.stat(source)
+    if source_stat.st_size != destination_stat.st_size:
+        return False
+    if check == 'digest':
+        if digest is None:
+            return _file_digest(source) == _file_digest(destination)
+        return (digest(source, source_stat) ==
+                digest(destination, destination_stat))
+    return source_stat.st_mtime == destination_stat.st_mtime
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reflink(source, destination):
+    """Clone `source` to `destination` (copy-on-write) with FICLONE."""
+    import fcntl
+    FICLONE = 0x40049409
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, destination)
 
 # todo: Add the filenames of the assests to the url list in context
 #       so that _update_content can fix relative URLs
@@ -132,11 +300,19 @@ class HiPage(contents.Page):
     in the property `sub_pages`, where the `name`s are the keys to the mapping.
     If you need to add sub pages, you'll have to work directly with the
     `sub_pages` OrderedDict.
+
+    The ancestors and the path of names of a page are cached. Setting the
+    `parent` of any page bumps `_hierarchy_version`, which invalidates the
+    caches of all pages, so re-parenting while the tree is built is safe.
     """
 
+    # Incremented whenever any page is re-parented, see `_hierarchy_info`.
+    _hierarchy_version = 0
+
     def __init__(self, content, metadata=None, settings=None,
                  source_path=None, context=None, slug=None, name=None,
                  title=None, parent=None, virtual=False, **kws):
+        self._hierarchy_cache = None
         self.parent = parent
         self.sub_pages = OrderedDict()
         self.order = ""
@@ -202,8 +378,9 @@ class HiPage(contents.Page):
         if self._slug is not None:
             return self._slug
         else:
-            s = [p.name for p in self.hierarchy if p.parent] + [self.name]
-            return ">".join(s)
+            # the ancestors come first from self.parent upwards
+            names = self._hierarchy_info()[1]
+            return ">".join(names[-2::-1] + names[-1:])
 
     @slug.setter
     def slug(self, value):
@@ -229,18 +406,46 @@ class HiPage(contents.Page):
     def has_children(self):
         return bool(len(self))
 
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, value):
+        self._parent = value
+        HiPage._hierarchy_version += 1
+
+    def _hierarchy_info(self):
+        """
+        Return the tuple of ancestors (from self.parent upwards to root) and
+        the tuple of names from the first level down to this page.
+
+        Both are computed from the (cached) info of the parent and cached
+        until any page is re-parented.
+        """
+        cache = self._hierarchy_cache
+        if cache is not None and cache[0] == HiPage._hierarchy_version:
+            return cache[1], cache[2]
+        if self.parent is None:
+            ancestors, names = (), (self.name,)
+        else:
+            parent_ancestors, parent_names = self.parent._hierarchy_info()
+            ancestors = (self.parent,) + parent_ancestors
+            if self.parent.parent is None:
+                parent_names = ()  # the root is not part of the path
+            names = parent_names + (self.name,)
+        self._hierarchy_cache = (HiPage._hierarchy_version, ancestors, names)
+        return ancestors, names
+
     @property
     def hierarchy(self):
-        """Generator giving pages, from self.parent upwards to root."""
-        up = self.parent
-        while up is not None:
-            yield up
-            up = up.parent
+        """Iterator giving pages, from self.parent upwards to root."""
+        return iter(self._hierarchy_info()[0])
 
     @property
     def level(self):
         """The level (depth) in the hierarchy. The virtual root page has 0."""
-        return len(list(self.hierarchy))
+        return len(self._hierarchy_info()[0])
 
     @property
     def breadcrumps(self):
@@ -258,9 +463,7 @@ class HiPage(contents.Page):
         expansion.
         """
         metadata = getattr(super(HiPage, self), "url_format")
-        hi = "/".join(list(reversed([p.name for p in self.hierarchy
-                                     if p.parent])) +
-                      [self.name])
+        hi = "/".join(self._hierarchy_info()[1])
         metadata.update({'hierarchy': hi, 'name': self.name})
         return metadata
 
@@ -272,7 +475,7 @@ class HiPage(contents.Page):
         return "<{cl} {url}>".format(cl=self.__class__.__name__, url=self.url)
 
     def print_tree(self):
-        print(ascii_tree(self, print_item=lambda x: x.title))
+        write_ascii_tree(self, sys.stdout, print_item=lambda x: x.title)
 
 
 class HiPagesGenerator(generators.PagesGenerator):
@@ -309,20 +512,31 @@ class HiPagesGenerator(generators.PagesGenerator):
         self.PAGES_TREE = root
 
         # Fix (hack): Go through all translations and add the missing sub-pages
+        # of the (first) page with the same name.
+        pages_by_name = {}
+        for p in self.pages:
+            pages_by_name.setdefault(p.name, p)
         for page in self.translations:
-            # find corresponding page
-            orig_page = None
-            for p in self.pages:
-                if p.name == page.name:
-                    orig_page = p
-                    break
-            page.sub_pages.update(orig_page.sub_pages)
+            page.sub_pages.update(pages_by_name[page.name].sub_pages)
+
+        # The tree is final now, fill the hierarchy caches of all pages.
+        for page in (self.pages + self.translations +
+                     self.hidden_pages + self.hidden_translations):
+            page._hierarchy_info()
 
         self._update_context(['pages', 'hidden_pages', 'PAGES_TREE'])
+        self.readers.save_cache()
         # self.context['PAGES'] = self.pages
         # self.context['PAGES_TREE'] = root
-        logger.info("\n" + ascii_tree(self.context['PAGES_TREE'],
-                                      print_item=lambda x: x.title))
+        # Rendering the tree of a large site is not free, so it is only
+        # logged if asked for.
+        if self.settings.get('HIERARCHY_LOG_TREE', False):
+            level = logging.INFO
+        else:
+            level = logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, "\n" + "\n".join(iter_ascii_tree(
+                self.context['PAGES_TREE'], print_item=lambda x: x.title)))
 
         signals.page_generator_finalized.send(self)
 
@@ -331,45 +545,117 @@ class HiPagesGenerator(generators.PagesGenerator):
         """
         Recursively scan `base_path/rel_path` for source files.
 
-        Symlinks are followed.
+        Symlinks are followed. The directory tree is scanned first, then
+        the page files are read (see `_read_pages`) and finally the
+        `HiPage` tree is assembled in sorted order, so that the result does
+        not depend on the order in which pages were read.
 
         `base_path`: Absolute directory path (`str`).
         `rel_path`: The relative dir below `base_path` to start scanning.
         `exclude`: Directory names to exclude.
         `parent`: The `HiPage` that is used as the parent for items in `path`.
         """
-        pages = []
-        hidden_pages = []
+        entries = self._scan_tree(base_path, rel_path, exclude, extensions)
+        read_pages = self._read_pages(base_path, _tree_files(entries))
+        return self._assemble_tree(entries, read_pages, parent)
+
+    def _scan_tree(self, base_path, rel_path, exclude, extensions):
+        """
+        Return the sorted `(item, rel_item, children)` entries below
+        `base_path/rel_path`. `children` is None for page files and the
+        list of entries of a directory otherwise.
+        """
+        entries = []
         path = os.path.join(base_path, rel_path)
+        with os.scandir(path) as it:
+            dir_entries = sorted(it, key=lambda entry: entry.name)
 
-        for item in sorted(os.listdir(path)):
+        for entry in dir_entries:
+            item = entry.name
             # Get the path to the `item` relative to the base_path
-            abs_item = os.path.join(path, item)
             rel_item = os.path.join(os.path.relpath(path, base_path), item)
             logger.debug("Scanning {}".format(rel_item))
 
-            if os.path.isfile(abs_item):
+            if entry.is_file():
                 # Using the include logic from parent class:
                 if not self._include_path(rel_item, extensions):
                     logger.debug("... skipping {} (unknown extension)".
                                  format(rel_item))
                     continue
+                entries.append((item, rel_item, None))
 
-                try:
-                    page = self.readers.read_file(
-                        base_path=base_path,
-                        path=rel_item,
-                        content_class=HiPage,
-                        context=self.context,
-                        preread_signal=signals.page_generator_preread,
-                        preread_sender=self,
-                        context_signal=signals.page_generator_context,
-                        context_sender=self)
-                except Exception as e:
-                    logger.warning('could not process {}\n{}'
-                                   .format(rel_item, e))
+            elif entry.is_dir():
+                if item in exclude:
                     continue
+                entries.append((item, rel_item, self._scan_tree(
+                    base_path, rel_item, exclude, extensions)))
+
+            else:
+                raise Exception("not a dir and not a file")  # possible at all?
+
+        return entries
+
+    def _read_pages(self, base_path, rel_items):
+        """
+        Read the page files `rel_items` and return a mapping of each to a
+        tuple `(page, error)`.
+
+        With the setting `HIERARCHY_READ_THREADS` > 1 the files are read
+        by a thread pool. Each thread has its own reader instances, because
+        they keep per-file state, but shares the reader classes and the
+        content cache of `self.readers`. Readers and plugins connected to
+        the page reading signals have to be thread-safe then.
+        """
+        threads = self.settings.get('HIERARCHY_READ_THREADS', 1)
+        if threads <= 1 or len(rel_items) <= 1:
+            return dict((rel_item, self._read_page(self.readers, base_path,
+                                                   rel_item))
+                        for rel_item in rel_items)
+
+        local = threading.local()
+
+        def read(rel_item):
+            if not hasattr(local, 'readers'):
+                local.readers = copy.copy(self.readers)
+                local.readers.readers = dict(
+                    (fmt, reader.__class__(self.settings))
+                    for fmt, reader in self.readers.readers.items())
+            return self._read_page(local.readers, base_path, rel_item)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return dict(zip(rel_items, executor.map(read, rel_items)))
+
+    def _read_page(self, page_readers, base_path, rel_item):
+        try:
+            page = page_readers.read_file(
+                base_path=base_path,
+                path=rel_item,
+                content_class=HiPage,
+                context=self.context,
+                preread_signal=signals.page_generator_preread,
+                preread_sender=self,
+                context_signal=signals.page_generator_context,
+                context_sender=self)
+        except Exception as e:
+            return None, e
+        return page, None
+
+    def _assemble_tree(self, entries, read_pages, parent):
+        """
+        Add the pages read for `entries` to the tree below `parent` and
+        return the lists of (published or draft) pages and hidden pages.
+        """
+        pages = []
+        hidden_pages = []
+        replaced = Counter()  # virtual pages replaced by a page file
 
+        for item, rel_item, children in entries:
+            if children is None:
+                page, error = read_pages[rel_item]
+                if error is not None:
+                    logger.warning('could not process {}\n{}'
+                                   .format(rel_item, error))
+                    continue
                 if not page.is_valid():
                     logger.warn('invalid content for ' + rel_item)
                     continue
@@ -385,7 +671,8 @@ class HiPagesGenerator(generators.PagesGenerator):
                         for sub in parent.sub_pages[page.name]:
                             page.sub_pages[sub.name] = sub
                             sub.parent = page
-                        pages.remove(parent.sub_pages[page.name])
+                        # removed from `pages` before returning
+                        replaced[parent.sub_pages[page.name]] += 1
                         del parent.sub_pages[page.name]
                     elif page.in_default_lang:
                         # if this page is in_default_lang then we just replace
@@ -422,11 +709,7 @@ class HiPagesGenerator(generators.PagesGenerator):
                                    "skipping it." %
                                    (repr(page.status), repr(rel_item)))
 
-            elif os.path.isdir(abs_item):
-
-                if item in exclude:
-                    continue
-
+            else:
                 # Virtual page, that is used when there is not already a page
                 # with the same name under the current `parent`.
                 m = readers.parse_path_metadata(
@@ -459,21 +742,38 @@ class HiPagesGenerator(generators.PagesGenerator):
                 self.add_source_path(page)
                 pages.append(page)
 
-                # Recursively descent into the directory
-                ps, hs = self._scan_dir_r(base_path=base_path,
-                                          rel_path=rel_item,
-                                          exclude=exclude,
-                                          parent=page)
+                # Descent into the directory
+                ps, hs = self._assemble_tree(children, read_pages, page)
                 pages.extend(ps)
                 hidden_pages.extend(hs)
 
-            else:
-                raise Exception("not a dir and not a file")  # possible at all?
+        if replaced:
+            # Drop (the first occurrences of) the replaced virtual pages in
+            # a single pass instead of `list.remove` for each of them.
+            kept = []
+            for page in pages:
+                if replaced[page]:
+                    replaced[page] -= 1
+                else:
+                    kept.append(page)
+            pages = kept
+
         logger.debug("---------------")
 
         return pages, hidden_pages
 
 
+def _tree_files(entries):
+    """Return the `rel_item`s of all page files of scanned `entries`."""
+    files = []
+    for item, rel_item, children in entries:
+        if children is None:
+            files.append(rel_item)
+        else:
+            files.extend(_tree_files(children))
+    return files
+
+
 def remove_normal_pages(self):
     """This is a hack to keep Pelican from generating the normal Pages."""
     if self.__class__ == generators.PagesGenerator:
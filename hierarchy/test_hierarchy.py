@@ -4,13 +4,13 @@ import locale
 import logging
 
 from tempfile import mkdtemp
-from pelican import Pelican
+from pelican import Pelican, signals
 from pelican.settings import read_settings
 from shutil import rmtree
 
 CUR_DIR = os.path.dirname(__file__)
 
-import hierarchy
+from . import hierarchy
 
 
 # todo
@@ -45,3 +45,166 @@ class TestHierarchy(unittest.TestCase):
     #     assert os.path.exists(os.path.join(self.temp_path,
     #                                        'pdf',
     #                                        'this-is-a-super-article.pdf'))
+
+
+class TestReadPages(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = mkdtemp(prefix='pelicantests.')
+        self.content_path = os.path.join(self.temp_path, 'content')
+        os.makedirs(os.path.join(self.content_path, 'pages', 'sub'))
+        for name in ['a', 'b', 'sub/c', 'sub/d']:
+            with open(os.path.join(self.content_path, 'pages',
+                                   name + '.html'), 'w') as f:
+                f.write('<html><head><title>{0}</title></head>'
+                        '<body>{0}</body></html>'.format(name))
+
+    def tearDown(self):
+        rmtree(self.temp_path)
+
+    def generate_context(self, **override):
+        override.update(PATH=self.content_path,
+                        CACHE_PATH=os.path.join(self.temp_path, 'cache'),
+                        HIPAGE_URL=hierarchy.HIPAGE_URL,
+                        HIPAGE_SAVE_AS=hierarchy.HIPAGE_SAVE_AS,
+                        HIPAGE_LANG_URL=hierarchy.HIPAGE_LANG_URL,
+                        HIPAGE_LANG_SAVE_AS=hierarchy.HIPAGE_LANG_SAVE_AS)
+        settings = read_settings(override=override)
+        context = dict(settings, generated_content={}, static_content={},
+                       static_links=set())
+        generator = hierarchy.HiPagesGenerator(
+            context=context, settings=settings, path=settings['PATH'],
+            theme=settings['THEME'], output_path=self.temp_path)
+        generator.generate_context()
+        return generator
+
+    def test_read_threads(self):
+        inits = []
+
+        def count_init(readers):
+            inits.append(readers)
+
+        signals.readers_init.connect(count_init)
+        self.addCleanup(signals.readers_init.disconnect, count_init)
+        pages = self.generate_context().pages
+        del inits[:]
+        threaded_pages = self.generate_context(
+            HIERARCHY_READ_THREADS=4).pages
+        self.assertEqual(len(inits), 1)  # only for the generator
+        self.assertEqual([(p.title, p.content, p.url) for p in pages],
+                         [(p.title, p.content, p.url)
+                          for p in threaded_pages])
+        self.assertEqual(len(pages), 5)  # with the index of sub/
+
+    def test_virtual_page_replaced_by_page_file(self):
+        os.makedirs(os.path.join(self.content_path, 'pages', 'sub', 'deep'))
+        for name in ['sub', 'sub/deep/e']:
+            with open(os.path.join(self.content_path, 'pages',
+                                   name + '.html'), 'w') as f:
+                f.write('<html><head><title>{0}</title></head>'
+                        '<body>{0}</body></html>'.format(name))
+        pages = self.generate_context().pages
+        by_name = dict((p.name, p) for p in pages)
+        self.assertFalse(by_name['c'].parent.virtual)
+        self.assertIs(by_name['c'].parent, by_name['sub'])
+        for page in pages:
+            # walk the tree without the cached hierarchy info
+            hierarchy = []
+            up = page.parent
+            while up is not None:
+                hierarchy.append(up)
+                up = up.parent
+            ancestors = [p for p in hierarchy if p.parent]
+            names = [p.name for p in ancestors]
+            self.assertEqual(page.slug, ">".join(names + [page.name]))
+            self.assertEqual(page.level, len(hierarchy))
+            self.assertEqual(page.url_format['hierarchy'],
+                             "/".join(names[::-1] + [page.name]))
+            self.assertEqual(list(page.breadcrumps),
+                             [(p.url, p.title) for p in ancestors[::-1]])
+        self.assertEqual(by_name['e'].slug, 'deep>sub>e')
+
+
+class TestCopyStaticAssets(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = mkdtemp(prefix='pelicantests.')
+        self.content_path = os.path.join(self.temp_path, 'content')
+        self.output_path = os.path.join(self.temp_path, 'output')
+        os.mkdir(self.content_path)
+        self.write('a.pdf', b'pdf')
+        self.write('b.png', b'png')
+        self.digested = []
+        file_digest = hierarchy._file_digest
+
+        def counting_file_digest(path):
+            self.digested.append(os.path.relpath(path, self.temp_path))
+            return file_digest(path)
+
+        hierarchy._file_digest = counting_file_digest
+        self.addCleanup(setattr, hierarchy, '_file_digest', file_digest)
+
+    def tearDown(self):
+        rmtree(self.temp_path)
+
+    def write(self, name, data):
+        with open(os.path.join(self.content_path, name), 'wb') as f:
+            f.write(data)
+
+    def output(self, name):
+        return os.path.join(self.output_path, name)
+
+    def generate(self, **override):
+        override.update(PATH=self.content_path,
+                        CACHE_PATH=os.path.join(self.temp_path, 'cache'))
+        settings = read_settings(override=override)
+        generator = hierarchy.CopyStaticAssetsGenerator(
+            context={}, settings=settings, path=settings['PATH'],
+            theme=settings['THEME'], output_path=self.output_path)
+        generator.generate_output(None)
+
+    def test_mtime(self):
+        self.generate(HIERARCHY_STATIC_CHECK_IF_MODIFIED='mtime')
+        # a same-sized output with the mtime of its source is not copied
+        with open(self.output('a.pdf'), 'wb') as f:
+            f.write(b'old')
+        source_stat = os.stat(os.path.join(self.content_path, 'a.pdf'))
+        os.utime(self.output('a.pdf'),
+                 (source_stat.st_atime, source_stat.st_mtime))
+        self.generate(HIERARCHY_STATIC_CHECK_IF_MODIFIED='mtime')
+        with open(self.output('a.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        os.utime(self.output('a.pdf'), (0, 0))
+        self.generate(HIERARCHY_STATIC_CHECK_IF_MODIFIED='mtime')
+        with open(self.output('a.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), b'pdf')
+
+    def test_digest(self):
+        self.generate(HIERARCHY_STATIC_CHECK_IF_MODIFIED='digest')
+        # nothing to compare with in the first build
+        self.assertEqual(self.digested, [])
+        self.generate(HIERARCHY_STATIC_CHECK_IF_MODIFIED='digest')
+        self.assertEqual(len(self.digested), 4)
+        del self.digested[:]
+        # the digests of unchanged files are cached
+        self.generate(HIERARCHY_STATIC_CHECK_IF_MODIFIED='digest')
+        self.assertEqual(self.digested, [])
+        self.write('a.pdf', b'PDF')
+        self.generate(HIERARCHY_STATIC_CHECK_IF_MODIFIED='digest')
+        self.assertEqual(self.digested, [os.path.join('content', 'a.pdf')])
+        with open(self.output('a.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), b'PDF')
+        del self.digested[:]
+        self.generate(HIERARCHY_STATIC_CHECK_IF_MODIFIED='digest')
+        self.assertEqual(self.digested, [])
+
+    def test_hardlink(self):
+        self.generate(HIERARCHY_STATIC_LINKS='hardlink')
+        self.assertEqual(os.stat(self.output('a.pdf')).st_nlink, 2)
+        self.generate(HIERARCHY_STATIC_LINKS='hardlink')
+        self.assertEqual(os.stat(self.output('a.pdf')).st_nlink, 2)
+
+    def test_remove_orphans(self):
+        self.generate(HIERARCHY_STATIC_REMOVE_ORPHANS=True)
+        os.remove(os.path.join(self.content_path, 'b.png'))
+        self.generate(HIERARCHY_STATIC_REMOVE_ORPHANS=True)
+        self.assertTrue(os.path.exists(self.output('a.pdf')))
+        self.assertFalse(os.path.exists(self.output('b.png')))
@@ -5,15 +5,22 @@ This plugin is designed for Pelican 3.4 and later
 
 
 import os
+import re
+import sys
 import six
+import json
+import hashlib
 import logging
+import traceback
 import posixpath
+import multiprocessing
 
 from copy import copy
 from itertools import chain
 from operator import attrgetter
 from collections import OrderedDict
 from contextlib import contextmanager
+from importlib import import_module
 from six.moves.urllib.parse import urlparse
 
 import gettext
@@ -23,6 +30,8 @@ from pelican import signals
 from pelican.generators import ArticlesGenerator, PagesGenerator
 from pelican.settings import configure_settings
 from pelican.contents import Draft
+from pelican.readers import HTMLReader, MarkdownReader
+from pelican.urlwrappers import URLWrapper
 
 
 # Global vars
@@ -36,6 +45,26 @@ _SITES_RELPATH_DB = {}       # map: (lang, base_lang) -> relpath
 # map: generator -> list of removed contents that need interlinking
 _GENERATOR_DB = {}
 _NATIVE_CONTENT_URL_DB = {} # map: source_path -> content in its native lang
+_SUBSITE_WORKERS = []     # list of (lang, process) of parallel subsites
+_WORKER_CONNECTION = None # connection to the main process in a subsite worker
+# map: (source_path, settings fingerprint, digest) -> (content, metadata)
+_PARSED_CONTENT_DB = {}
+_SHARED_READER_CLASSES = {}   # map: reader class -> its sharing subclass
+# readers whose output does not depend on the language of the (sub-)site,
+# unlike e.g. RstReader which passes DEFAULT_LANG to docutils
+_LANGUAGE_INDEPENDENT_READERS = (MarkdownReader, HTMLReader)
+# settings which differ between (sub-)sites but do not change the output
+# of _LANGUAGE_INDEPENDENT_READERS
+_FINGERPRINT_EXCLUDED_SETTINGS = frozenset((
+    'SITEURL', 'OUTPUT_PATH', 'CACHE_PATH', 'STATIC_PATHS',
+    'THEME_STATIC_DIR', 'THEME_STATIC_PATHS', 'DEFAULT_LANG', 'LOCALE',
+    'FEED_DOMAIN'))
+# incremental builds, see skip_unchanged_subsites
+_SOURCE_DIGESTS = {}      # map: source_path -> digest, read by the main site
+_SITE_DEPENDENCIES = {}   # map: lang -> {'sources': set, 'native': set}
+_SITE_FINGERPRINTS = {}   # map: lang -> fingerprint of settings and theme
+_SKIPPED_SUBSITES = {}    # map: lang -> its state from the previous build
+_BUILD_STATE_FILE = None  # where the state of the main site is saved
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -68,6 +97,11 @@ def initialize_dbs(settings):
     _SITES_RELPATH_DB.clear()
     _NATIVE_CONTENT_URL_DB.clear()
     _GENERATOR_DB.clear()
+    _PARSED_CONTENT_DB.clear()
+    _SOURCE_DIGESTS.clear()
+    _SITE_DEPENDENCIES.clear()
+    _SITE_FINGERPRINTS.clear()
+    _SKIPPED_SUBSITES.clear()
 
 
 def prepare_site_db_and_overrides():
@@ -224,6 +258,111 @@ class GeneratorInspector(object):
                        for i in (0, 1)))
 
 
+def settings_fingerprint(settings):
+    '''Get a digest of the settings which may change the reader output
+
+    Only valid within one build, as reprs of e.g. functions are used.
+    '''
+    items = sorted((key, repr(value)) for key, value in settings.items()
+                   if key not in _FINGERPRINT_EXCLUDED_SETTINGS)
+    return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
+
+def rebind_metadata(metadata, settings):
+    '''Copy metadata, binding tags, categories, etc. to other settings
+
+    URLWrapper instances format their URLs with the settings of the
+    (sub-)site that created them, so they are recreated from their names.
+    '''
+    def rebind(value):
+        if isinstance(value, URLWrapper):
+            return value.__class__(value.name, settings)
+        if isinstance(value, list):
+            return [rebind(item) for item in value]
+        return value
+
+    return dict((key, rebind(value)) for key, value in metadata.items())
+
+
+def get_shared_reader_class(reader_class):
+    '''Get a subclass of reader_class sharing its output across sites
+
+    The output of ``read`` is stored in _PARSED_CONTENT_DB under the
+    source path, the fingerprint of the settings and the digest of the
+    file, so that subsites only parse sources whose parsing would differ.
+    Language-dependent steps (locale dates, URLs) are done later by the
+    content objects of each (sub-)site.
+    '''
+    if reader_class not in _SHARED_READER_CLASSES:
+        def read(self, source_path):
+            if getattr(self, '_i18n_fingerprint', None) is None:
+                self._i18n_fingerprint = settings_fingerprint(self.settings)
+            with open(source_path, 'rb') as source_file:
+                digest = hashlib.sha1(source_file.read()).hexdigest()
+            key = (source_path, self._i18n_fingerprint, digest)
+            if key not in _PARSED_CONTENT_DB:
+                _PARSED_CONTENT_DB[key] = reader_class.read(self, source_path)
+            else:
+                _LOGGER.debug('i18n: reusing parsed content of {}'.format(
+                    source_path))
+            content, metadata = _PARSED_CONTENT_DB[key]
+            return content, rebind_metadata(metadata, self.settings)
+
+        _SHARED_READER_CLASSES[reader_class] = type(
+            reader_class.__name__, (reader_class,), {'read': read})
+    return _SHARED_READER_CLASSES[reader_class]
+
+
+def share_parsed_content(readers):
+    '''Make the readers share their output across (sub-)sites
+
+    Only readers known not to depend on the language are shared, more
+    can be listed in the I18N_SHARED_READERS setting.
+    '''
+    if (_MAIN_SETTINGS is None or len(_SITE_DB) < 2 or
+            not _MAIN_SETTINGS.get('I18N_SHARE_PARSED_CONTENT', True)):
+        return
+    shareable = _LANGUAGE_INDEPENDENT_READERS + tuple(
+        _MAIN_SETTINGS.get('I18N_SHARED_READERS', ()))
+    for fmt, reader_class in list(readers.reader_classes.items()):
+        if reader_class in shareable:
+            readers.reader_classes[fmt] = get_shared_reader_class(
+                reader_class)
+
+
+def source_digest(source_path):
+    '''Get the digest of the source file, None if it cannot be read'''
+    try:
+        with open(source_path, 'rb') as source_file:
+            return hashlib.sha1(source_file.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def record_source_digests(inspector):
+    '''Record digests of all the content read by the main site'''
+    for content in inspector.all_contents():
+        if content.source_path not in _SOURCE_DIGESTS:
+            _SOURCE_DIGESTS[content.source_path] = source_digest(
+                content.source_path)
+
+
+def record_dependencies(inspector, lang):
+    '''Record the sources the filtered content of a site depends on
+
+    These are the sources of its (hidden) content and of their
+    translations, whose native URLs it links to.
+    '''
+    dependencies = _SITE_DEPENDENCIES.setdefault(
+        lang, {'sources': set(), 'native': set()})
+    for content in inspector.all_contents():
+        if content.lang == lang:
+            dependencies['native'].add(content.source_path)
+        dependencies['sources'].add(content.source_path)
+        dependencies['sources'].update(
+            translation.source_path for translation in content.translations)
+
+
 def filter_contents_translations(generator):
     '''Filter the content and translations lists of a generator
 
@@ -236,28 +375,41 @@ def filter_contents_translations(generator):
     '''
     inspector = GeneratorInspector(generator)
     current_lang = generator.settings['DEFAULT_LANG']
-    langs_with_sites = _SITE_DB.keys()
+    langs_with_sites = set(_SITE_DB)
     removed_contents = _GENERATOR_DB[generator]
+    incremental = generator.settings.get('I18N_INCREMENTAL_SUBSITES', False)
+    if incremental and current_lang == _MAIN_LANG:
+        record_source_digests(inspector)
 
     for translations in inspector.translations_lists():
-        for translation in translations[:]:    # copy to be able to remove
+        kept = []
+        for translation in translations:
             if translation.lang in langs_with_sites:
-                translations.remove(translation)
                 removed_contents.append(translation)
+            else:
+                kept.append(translation)
+        translations[:] = kept     # in place, the generator holds the list
 
     hiding_func = inspector.hiding_function()
     untrans_policy = inspector.untranslated_policy(default='hide')
     for (contents, other_contents) in inspector.contents_list_pairs():
-        for content in contents[:]:        # copy for removing in loop
+        kept, hidden = [], []
+        for content in contents:
             if content.lang == current_lang: # in native lang
                 # save the native URL attr formatted in the current locale
                 _NATIVE_CONTENT_URL_DB[content.source_path] = content.url
             elif content.lang in langs_with_sites and untrans_policy != 'keep':
-                contents.remove(content)
                 if untrans_policy == 'hide':
-                    other_contents.append(hiding_func(content))
+                    hidden.append(hiding_func(content))
                 elif untrans_policy == 'remove':
                     removed_contents.append(content)
+                continue
+            kept.append(content)
+        contents[:] = kept
+        other_contents.extend(hidden)
+
+    if incremental:
+        record_dependencies(inspector, current_lang)
 
 
 def install_templates_translations(generator):
@@ -309,8 +461,11 @@ def interlink_translations(content):
     will be honored
     '''
     lang = content.lang
-    # sort translations by lang
-    content.translations.sort(key=attrgetter('lang'))
+    translations = content.translations
+    # sort translations by lang unless they already are
+    if any(previous.lang > translation.lang for previous, translation
+           in zip(translations, translations[1:])):
+        translations.sort(key=attrgetter('lang'))
     for translation in content.translations:
         relpath = relpath_to_site(lang, translation.lang)
         url = _NATIVE_CONTENT_URL_DB[translation.source_path]
@@ -384,6 +539,305 @@ def get_pelican_cls(settings):
     return cls
 
 
+def subsite_settings(overrides):
+    '''Get the settings of a subsite from the main settings and overrides'''
+    settings = _MAIN_SETTINGS.copy()
+    settings.update(overrides)
+    return configure_settings(settings)      # to set LOCALE, etc.
+
+
+def get_fork_context():
+    '''Get a multiprocessing context creating processes by forking
+
+    Workers must inherit the state of the main site, which is not
+    picklable, so parallel subsites are only available where fork is.
+    Returns None if it is not available.
+    '''
+    get_context = getattr(multiprocessing, 'get_context', None)
+    if get_context is None:                  # Python 2 forks on posix
+        return multiprocessing if hasattr(os, 'fork') else None
+    try:
+        return get_context('fork')
+    except ValueError:
+        return None
+
+
+def persistent_fingerprint(settings):
+    '''Get a digest of the settings comparable between builds'''
+    items = repr(sorted((key, repr(value)) for key, value in settings.items()))
+    items = re.sub(r' at 0x[0-9a-fA-F]+', '', items)   # reprs of objects
+    return hashlib.sha1(items.encode('utf-8')).hexdigest()
+
+
+def jinja_extension_files(settings):
+    '''Get the module files of the jinja2 extensions of the settings'''
+    extensions = settings.get('JINJA_ENVIRONMENT', {}).get('extensions', [])
+    extensions = chain(extensions, settings.get('JINJA_EXTENSIONS', []))
+    for extension in extensions:
+        if isinstance(extension, six.string_types):
+            module_name = extension.rpartition('.')[0]
+        else:
+            module_name = extension.__module__
+        try:
+            module = sys.modules.get(module_name) or import_module(module_name)
+        except ImportError:
+            continue                      # reported by jinja2
+        if getattr(module, '__file__', None):
+            yield module.__file__
+
+
+def files_signature(paths):
+    '''Get a digest of the paths, sizes and mtimes of files and dirs'''
+    files = []
+    for top in paths:
+        if os.path.isfile(top):
+            walk = [(os.path.dirname(top), [], [os.path.basename(top)])]
+        else:
+            walk = os.walk(top)
+        for dirpath, dirnames, filenames in walk:
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                files.append((path, stat.st_size, stat.st_mtime))
+    return hashlib.sha1(repr(sorted(files)).encode('utf-8')).hexdigest()
+
+
+def subsite_fingerprint(settings):
+    '''Get a digest of the settings and files a subsite is rendered with
+
+    These are its theme, its gettext catalogs and its jinja2 extensions.
+    '''
+    paths = [settings['THEME']]
+    if settings.get('I18N_GETTEXT_LOCALEDIR'):
+        paths.append(settings['I18N_GETTEXT_LOCALEDIR'])
+    paths.extend(jinja_extension_files(settings))
+    return hashlib.sha1((persistent_fingerprint(settings) +
+                         files_signature(paths)).encode('utf-8')).hexdigest()
+
+
+def load_build_state(state_file):
+    '''Load the state of the previous build, empty if not available'''
+    try:
+        with open(state_file) as fd:
+            return json.load(fd)
+    except (IOError, OSError, ValueError) as e:
+        if os.path.exists(state_file):
+            _LOGGER.warning('i18n: ignoring build state {}: {}'.format(
+                state_file, e))
+        return {}
+
+
+def is_subsite_unchanged(lang, overrides, state):
+    '''Tell if the subsite output of the previous build is still valid'''
+    previous = state.get('sites', {}).get(lang)
+    if (previous is None or
+            previous.get('fingerprint') != _SITE_FINGERPRINTS[lang]):
+        return False
+    if not os.path.isdir(overrides['OUTPUT_PATH']):
+        return False
+    if set(state.get('sources', {})) != set(_SOURCE_DIGESTS):
+        return False                      # added or removed content
+    if any(_SOURCE_DIGESTS.get(path) != digest
+           for path, digest in previous['sources'].items()):
+        return False
+    # native URLs of the main site are known already, those of the other
+    # subsites are checked in save_build_state
+    return all(_NATIVE_CONTENT_URL_DB.get(path, url) == url
+               for path, url in previous['linked_urls'].items())
+
+
+def skip_unchanged_subsites():
+    '''Remove subsites with unchanged inputs from the generation queue
+
+    The inputs of a subsite are its settings and rendering files (see
+    ``subsite_fingerprint``) and the sources it depends on (see
+    ``record_dependencies``) with the native URLs of their translations.
+    They are compared with the build state saved in the CACHE_PATH of the
+    main site. A native URL only changes with the digest of its source,
+    which the subsites linking to it depend on already, or with the
+    fingerprint of its subsite. The new URLs of subsites with a changed
+    fingerprint are not known yet, so the subsites depending on their
+    content are rebuilt too. The native URLs of skipped subsites are
+    restored from the state to interlink the rebuilt sites.
+    '''
+    global _BUILD_STATE_FILE
+    if not _MAIN_SETTINGS.get('I18N_INCREMENTAL_SUBSITES', False):
+        return
+    _BUILD_STATE_FILE = os.path.join(_MAIN_SETTINGS['CACHE_PATH'],
+                                     'i18n_subsites.json')
+    state = load_build_state(_BUILD_STATE_FILE)
+    # the output of all the sites is removed before writing the main site
+    reuse_output = not _MAIN_SETTINGS.get('DELETE_OUTPUT_DIRECTORY', False)
+    unchanged = {}
+    for lang, overrides in _SUBSITE_QUEUE.items():
+        _SITE_FINGERPRINTS[lang] = subsite_fingerprint(
+            subsite_settings(overrides))
+        if reuse_output and is_subsite_unchanged(lang, overrides, state):
+            unchanged[lang] = state['sites'][lang]
+    previous_sites = state.get('sites', {})
+    # subsites rebuilt because of their sources keep their native URLs
+    refingerprinted = set(
+        lang for lang, site in previous_sites.items()
+        if site.get('fingerprint') != _SITE_FINGERPRINTS.get(lang))
+    native_langs = dict((path, lang)
+                        for lang, site in previous_sites.items()
+                        for path in site['native_urls'])
+    for lang, previous in list(unchanged.items()):
+        if any(native_langs.get(path) in refingerprinted
+               for path in previous['sources']):
+            del unchanged[lang]
+    for lang, previous in unchanged.items():
+        _NATIVE_CONTENT_URL_DB.update(previous['native_urls'])
+        _SKIPPED_SUBSITES[lang] = previous
+        del _SUBSITE_QUEUE[lang]
+
+
+def save_build_state(pelican_obj):
+    '''Save the build state and log which subsites were rebuilt'''
+    global _BUILD_STATE_FILE
+    if (_BUILD_STATE_FILE is None or
+            pelican_obj.settings.get('DEFAULT_LANG') != _MAIN_LANG):
+        return
+    sites = dict(_SKIPPED_SUBSITES)
+    for lang, dependencies in _SITE_DEPENDENCIES.items():
+        if lang not in _SITE_FINGERPRINTS:
+            continue                      # the main site
+        native = dependencies['native']
+        sites[lang] = {
+            'fingerprint': _SITE_FINGERPRINTS[lang],
+            'sources': dict((path, _SOURCE_DIGESTS.get(path))
+                            for path in dependencies['sources']),
+            'native_urls': dict((path, _NATIVE_CONTENT_URL_DB[path])
+                                for path in native
+                                if path in _NATIVE_CONTENT_URL_DB),
+            'linked_urls': dict((path, _NATIVE_CONTENT_URL_DB[path])
+                                for path in dependencies['sources']
+                                if path not in native and
+                                path in _NATIVE_CONTENT_URL_DB),
+        }
+    state_dir = os.path.dirname(_BUILD_STATE_FILE)
+    if state_dir and not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    with open(_BUILD_STATE_FILE, 'w') as fd:
+        json.dump({'sources': _SOURCE_DIGESTS, 'sites': sites}, fd)
+    _BUILD_STATE_FILE = None
+
+    rebuilt = sorted(lang for lang in _SITE_FINGERPRINTS
+                     if lang not in _SKIPPED_SUBSITES)
+    _LOGGER.info('i18n: rebuilt subsites: {}; unchanged subsites: {}'.format(
+        ', '.join(rebuilt) or 'none',
+        ', '.join(sorted(_SKIPPED_SUBSITES)) or 'none'))
+
+
+def build_subsite_in_worker(lang, overrides, connection):
+    '''Build a subsite in a forked worker process
+
+    The worker inherits the DBs of the main site as snapshots. When its
+    content is ready to be written (see ``exchange_native_urls``) it sends
+    its native content URLs to the main process and receives those of all
+    the sites, then interlinks its content and writes its output.
+    '''
+    global _WORKER_CONNECTION
+    _WORKER_CONNECTION = connection
+    del _SUBSITE_WORKERS[:]                  # not children of this worker
+    _SUBSITE_QUEUE.clear()                   # the main process forks them
+    _GENERATOR_DB.clear()                    # generators of the main site
+    _SITE_DEPENDENCIES.clear()               # dependencies of the main site
+    try:
+        settings = subsite_settings(overrides)
+        cls = get_pelican_cls(settings)
+        _LOGGER.debug(("Generating i18n subsite for language '{}' "
+                       "using class {} in process {}").format(
+                           lang, cls, os.getpid()))
+        cls(settings).run()
+    except BaseException:
+        if _WORKER_CONNECTION is not None:
+            _WORKER_CONNECTION.send(('error', traceback.format_exc()))
+        raise
+    finally:
+        connection.close()
+
+
+def exchange_native_urls():
+    '''Exchange native content URLs of a worker with the main process'''
+    global _WORKER_CONNECTION
+    _WORKER_CONNECTION.send(
+        ('urls', (_NATIVE_CONTENT_URL_DB, _SITE_DEPENDENCIES)))
+    _NATIVE_CONTENT_URL_DB.update(_WORKER_CONNECTION.recv())
+    _WORKER_CONNECTION = None                # errors are on exit status now
+
+
+def build_subsites_in_parallel(context):
+    '''Fork one worker per subsite and wait until all read their content
+
+    The native content URLs of all the sites are merged and sent back to
+    the workers so that they can interlink their content. The workers
+    then write their output while the main site writes its own; they are
+    joined in ``join_subsite_workers``.
+    '''
+    connections = []
+    for lang, overrides in sorted(_SUBSITE_QUEUE.items()):
+        parent_connection, child_connection = context.Pipe()
+        process = context.Process(
+            target=build_subsite_in_worker,
+            args=(lang, overrides, child_connection))
+        process.start()
+        child_connection.close()
+        _SUBSITE_WORKERS.append((lang, process))
+        connections.append((lang, parent_connection))
+    _SUBSITE_QUEUE.clear()
+
+    errors = []
+    for lang, connection in connections:
+        try:
+            kind, data = connection.recv()
+        except EOFError:
+            kind, data = 'error', 'worker exited unexpectedly'
+        if kind == 'error':
+            errors.append("i18n subsite '{}' failed:\n{}".format(lang, data))
+        else:
+            native_urls, dependencies = data
+            _NATIVE_CONTENT_URL_DB.update(native_urls)
+            _SITE_DEPENDENCIES.update(dependencies)
+
+    for lang, connection in connections:
+        if not errors:
+            connection.send(_NATIVE_CONTENT_URL_DB)
+        connection.close()
+    if errors:
+        join_subsite_workers()
+        raise RuntimeError('\n'.join(errors))
+
+
+def join_subsite_workers(pelican_obj=None):
+    '''Wait for the parallel subsite workers to finish writing
+
+    Returns the list of errors of the workers which failed.
+    '''
+    errors = []
+    while _SUBSITE_WORKERS:
+        lang, process = _SUBSITE_WORKERS.pop(0)
+        process.join()
+        if process.exitcode != 0:
+            errors.append("i18n subsite '{}' exited with code {}".format(
+                lang, process.exitcode))
+            # its state is not saved, so that the next build rebuilds it
+            _SITE_DEPENDENCIES.pop(lang, None)
+    return errors
+
+
+def finalize_subsites(pelican_obj):
+    '''Join the subsite workers and save the state of the build
+
+    Fails like a sequential build if a worker failed to write its output,
+    once the state of the other subsites is saved.
+    '''
+    errors = join_subsite_workers(pelican_obj)
+    save_build_state(pelican_obj)
+    if errors:
+        raise RuntimeError('\n'.join(errors))
+
+
 def create_next_subsite(pelican_obj):
     '''Create the next subsite using the lang-specific config
 
@@ -393,8 +847,24 @@ def create_next_subsite(pelican_obj):
     language and overrides for next the subsite in the queue and apply
     overrides.  Then generate the subsite using a PELICAN_CLASS
     instance and its run method. Finally, restore the previous locale.
+
+    With ``I18N_PARALLEL_SUBSITES`` all subsites are instead built at
+    once in forked worker processes, see ``build_subsites_in_parallel``.
     '''
     global _MAIN_SETTINGS
+    if _WORKER_CONNECTION is not None:
+        # in a worker, the content of its subsite is ready
+        exchange_native_urls()
+    elif pelican_obj.settings is _MAIN_SETTINGS:
+        skip_unchanged_subsites()
+        if len(_SUBSITE_QUEUE) != 0 and _MAIN_SETTINGS.get(
+                'I18N_PARALLEL_SUBSITES', False):
+            context = get_fork_context()
+            if context is not None:
+                build_subsites_in_parallel(context)
+            else:
+                _LOGGER.warning('i18n: I18N_PARALLEL_SUBSITES requires '
+                                'fork, building subsites one at a time.')
     if len(_SUBSITE_QUEUE) == 0:
         _LOGGER.debug(
             'i18n: Updating cross-site links and context of all generators.')
@@ -402,10 +872,8 @@ def create_next_subsite(pelican_obj):
         _MAIN_SETTINGS = None             # to initialize next time
     else:
         with temporary_locale():
-            settings = _MAIN_SETTINGS.copy()
             lang, overrides = _SUBSITE_QUEUE.popitem()
-            settings.update(overrides)
-            settings = configure_settings(settings)      # to set LOCALE, etc.
+            settings = subsite_settings(overrides)
             cls = get_pelican_cls(settings)
 
             new_pelican_obj = cls(settings)
@@ -422,6 +890,8 @@ _SIGNAL_HANDLERS_DB = {
     'get_writer': create_next_subsite,
     'static_generator_finalized': save_main_static_files,
     'generator_init': save_generator,
+    'readers_init': share_parsed_content,
+    'finalized': finalize_subsites,
 }
 
 
@@ -11,6 +11,7 @@ from . import i18n_subsites as i18ns
 from pelican import Pelican
 from pelican.tests.support import get_settings
 from pelican.settings import read_settings
+from pelican.readers import Readers
 
 
 class TestTemporaryLocale(unittest.TestCase):
@@ -73,6 +74,202 @@ class TestSitesRelpath(unittest.TestCase):
         self.assertEqual(i18ns.relpath_to_site('de', 'en'), '..')
 
         
+class TestSharedParsedContent(unittest.TestCase):
+    '''Test sharing reader output between the sites'''
+
+    def setUp(self):
+        '''Create sources and pretend to build an en site with a de subsite'''
+        self.content_path = mkdtemp(prefix='pelican_content.')
+        with open(os.path.join(self.content_path, 'note.rst'), 'w') as fd:
+            fd.write('Note\n####\n\n.. note:: Text\n')
+        with open(os.path.join(self.content_path, 'page.md'), 'w') as fd:
+            fd.write('Title: Page\nTags: a, b\n\nSome *text*\n')
+        self.settings = get_settings(DEFAULT_LANG='en', SITEURL='')
+        self.subsite_settings = dict(self.settings, DEFAULT_LANG='de',
+                                     SITEURL='/de')
+        i18ns._MAIN_SETTINGS = self.settings
+        i18ns._SITE_DB.update((('en', ''), ('de', '/de')))
+        i18ns.signals.readers_init.connect(i18ns.share_parsed_content)
+
+    def tearDown(self):
+        '''Reset the DBs'''
+        i18ns.signals.readers_init.disconnect(i18ns.share_parsed_content)
+        i18ns._MAIN_SETTINGS = None
+        i18ns._SITE_DB.clear()
+        i18ns._PARSED_CONTENT_DB.clear()
+        rmtree(self.content_path)
+
+    def read(self, settings, path):
+        '''Read a source with the readers of a site'''
+        return Readers(settings).read_file(self.content_path, path)
+
+    def test_markdown_is_parsed_once(self):
+        '''Test that subsites reuse the parsed Markdown of the main site'''
+        page = self.read(self.settings, 'page.md')
+        subsite_page = self.read(self.subsite_settings, 'page.md')
+        self.assertEqual(len(i18ns._PARSED_CONTENT_DB), 1)
+        self.assertEqual(page.content, subsite_page.content)
+        self.assertEqual(subsite_page.lang, 'de')
+        # tags format their URLs with the settings of their own site
+        self.assertIs(subsite_page.tags[0].settings, self.subsite_settings)
+
+    def test_rst_is_parsed_in_the_subsite_language(self):
+        '''Test that reST content uses the language of each site'''
+        page = self.read(self.settings, 'note.rst')
+        subsite_page = self.read(self.subsite_settings, 'note.rst')
+        self.assertEqual(len(i18ns._PARSED_CONTENT_DB), 0)
+        self.assertIn('Note', page.content)
+        self.assertIn('Bemerkung', subsite_page.content)
+
+
+class MainSite(object):
+    '''Stand-in for the Pelican instance of the main site'''
+
+    def __init__(self, settings):
+        self.settings = settings
+
+
+class TestIncrementalSubsites(unittest.TestCase):
+    '''Test which subsites are rebuilt by incremental builds'''
+
+    # map: lang -> (native sources, sources of the linked translations)
+    SITES = {
+        'fr': (['a.fr', 'b.fr'], ['a.en', 'b.de']),
+        'de': (['b.de', 'c.de'], ['b.fr']),
+        'it': (['c.it'], ['c.de']),
+    }
+
+    def setUp(self):
+        '''Create the sources of an en site with fr, de and it subsites'''
+        self.temp_path = mkdtemp(prefix='pelican_incremental.')
+        self.content_path = os.path.join(self.temp_path, 'content')
+        os.mkdir(self.content_path)
+        for name in ['a.en', 'a.fr', 'b.fr', 'b.de', 'c.de', 'c.it']:
+            self.write(name, name)
+        self.catalog = os.path.join(self.temp_path, 'locale', 'fr',
+                                    'LC_MESSAGES', 'messages.mo')
+        os.makedirs(os.path.dirname(self.catalog))
+        self.write(self.catalog, 'catalog')
+        self.settings = get_settings(
+            PATH=self.content_path, I18N_INCREMENTAL_SUBSITES=True,
+            OUTPUT_PATH=os.path.join(self.temp_path, 'output'),
+            CACHE_PATH=os.path.join(self.temp_path, 'cache'),
+            I18N_SUBSITES={'fr': {'I18N_GETTEXT_LOCALEDIR': os.path.dirname(
+                os.path.dirname(os.path.dirname(self.catalog)))},
+                           'de': {}, 'it': {}})
+
+    def tearDown(self):
+        '''Remove the sources and reset the DBs'''
+        rmtree(self.temp_path)
+        i18ns.initialize_dbs(self.settings)
+        i18ns._MAIN_SETTINGS = None
+
+    def write(self, name, text):
+        '''Write a file of the content dir'''
+        with open(os.path.join(self.content_path, name), 'w') as fd:
+            fd.write(text)
+
+    def build(self):
+        '''Pretend to build the sites, return the rebuilt subsites'''
+        i18ns.initialize_dbs(self.settings)
+        for name in os.listdir(self.content_path):
+            path = os.path.join(self.content_path, name)
+            i18ns._SOURCE_DIGESTS[path] = i18ns.source_digest(path)
+        i18ns._NATIVE_CONTENT_URL_DB[
+            os.path.join(self.content_path, 'a.en')] = 'a.html'
+        i18ns.skip_unchanged_subsites()
+        rebuilt = sorted(i18ns._SUBSITE_QUEUE)
+        for lang in rebuilt:
+            native, linked = [[os.path.join(self.content_path, name)
+                               for name in names]
+                              for names in self.SITES[lang]]
+            i18ns._SITE_DEPENDENCIES[lang] = {'sources': set(native + linked),
+                                              'native': set(native)}
+            for path in native:
+                i18ns._NATIVE_CONTENT_URL_DB[path] = '{}/{}.html'.format(
+                    lang, os.path.basename(path))
+            output_path = os.path.join(self.settings['OUTPUT_PATH'], lang)
+            if not os.path.isdir(output_path):
+                os.makedirs(output_path)
+        i18ns.save_build_state(MainSite(self.settings))
+        return rebuilt
+
+    def test_unchanged_subsites_are_skipped(self):
+        '''Test that only the first build generates the subsites'''
+        self.assertEqual(self.build(), ['de', 'fr', 'it'])
+        self.assertEqual(self.build(), [])
+        # the native URLs of skipped subsites are restored
+        self.assertEqual(
+            i18ns._NATIVE_CONTENT_URL_DB[
+                os.path.join(self.content_path, 'c.it')], 'it/c.it.html')
+
+    def test_changed_source(self):
+        '''Test that subsites depending on a changed source are rebuilt'''
+        self.build()
+        self.write('c.it', 'changed')
+        self.assertEqual(self.build(), ['it'])
+        # no other subsite links to a.fr
+        self.write('a.fr', 'changed')
+        self.assertEqual(self.build(), ['fr'])
+        # de and fr link to b.de
+        self.write('b.de', 'changed')
+        self.assertEqual(self.build(), ['de', 'fr'])
+
+    def test_linked_subsites_are_rebuilt(self):
+        '''Test that subsites linking to a rebuilt subsite are rebuilt'''
+        self.build()
+        self.write(self.catalog, 'changed catalog')
+        # de links to fr content, it only to de content
+        self.assertEqual(self.build(), ['de', 'fr'])
+        self.assertEqual(self.build(), [])
+
+    def test_jinja_extension_files(self):
+        '''Test that the modules of the jinja2 extensions are found'''
+        import jinja2.ext
+        settings = {'JINJA_ENVIRONMENT': {'extensions': [
+            'jinja2.ext.i18n', jinja2.ext.LoopControlExtension]}}
+        self.assertEqual(list(i18ns.jinja_extension_files(settings)),
+                         [jinja2.ext.__file__] * 2)
+
+
+class WritingFailsPelican(object):
+    '''Subsite Pelican class failing after the native URLs exchange'''
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def run(self):
+        i18ns.create_next_subsite(self)      # content is ready to be written
+        raise RuntimeError('cannot write the output')
+
+
+@unittest.skipIf(i18ns.get_fork_context() is None, 'requires fork')
+class TestParallelSubsites(unittest.TestCase):
+    '''Test the failures of parallel subsite workers'''
+
+    def setUp(self):
+        self.temp_path = mkdtemp(prefix='pelican_parallel.')
+        self.settings = get_settings(
+            PATH=self.temp_path, OUTPUT_PATH=self.temp_path,
+            CACHE_PATH=self.temp_path, I18N_PARALLEL_SUBSITES=True,
+            I18N_SUBSITES={'de': {'PELICAN_CLASS': WritingFailsPelican}})
+        i18ns.initialize_dbs(self.settings)
+
+    def tearDown(self):
+        rmtree(self.temp_path)
+        i18ns.join_subsite_workers()
+        i18ns._MAIN_SETTINGS = None
+
+    def test_worker_fails_after_urls_exchange(self):
+        '''Test that the build fails once all the workers are joined'''
+        i18ns.build_subsites_in_parallel(i18ns.get_fork_context())
+        with self.assertRaises(RuntimeError) as context:
+            i18ns.finalize_subsites(MainSite(self.settings))
+        self.assertIn("subsite 'de' exited with code 1",
+                      str(context.exception))
+        self.assertEqual(i18ns._SUBSITE_WORKERS, [])
+
+
 class TestRegistration(unittest.TestCase):
     '''Test plugin registration'''
 
@@ -115,6 +312,15 @@ class TestFullRun(unittest.TestCase):
         test_data/content``
         Remember to remove the output/ folder before that.
         '''
+        self.generate_and_compare()
+
+    @unittest.skipIf(i18ns.get_fork_context() is None, 'fork not available')
+    def test_parallel_sites_generation(self):
+        '''Test that subsites built in parallel give the same output'''
+        self.generate_and_compare(I18N_PARALLEL_SUBSITES=True)
+
+    def generate_and_compare(self, **override):
+        '''Generate the sites and compare them with recorded output'''
         base_path = os.path.dirname(os.path.abspath(__file__))
         base_path = os.path.join(base_path, 'test_data')
         content_path = os.path.join(base_path, 'content')
@@ -127,6 +333,7 @@ class TestFullRun(unittest.TestCase):
             'PLUGINS': [i18ns],
             }
         )
+        settings.update(override)
         pelican = Pelican(settings)
         pelican.run()
 
@@ -22,12 +22,25 @@ Output
 
 [1] https://github.com/imathis/octopress/blob/master/plugins/image_tag.rb
 """
+import io
+import os
 import re
+import json
 import base64
-import urllib2
-from .mdx_liquid_tags import LiquidTags
+import hashlib
+import logging
+from multiprocessing.pool import ThreadPool
+
+from six.moves.urllib.request import Request, urlopen
+from six.moves.urllib.error import HTTPError, URLError
+
+from pelican import signals
+
+from .mdx_liquid_tags import LiquidTags, LT_CONFIG, find_tags
 import six
 
+logger = logging.getLogger(__name__)
+
 SYNTAX = '{% b64img [class name(s)] [http[s]:/]/path/to/image [width [height]] [title text | "title text" ["alt text"]] %}'
 
 # Regular expression to match the entire syntax
@@ -36,23 +49,126 @@ ReImg = re.compile("""(?P<class>\S.*\s+)?(?P<src>(?:https?:\/\/|\/|\S+\/)\S+)(?:
 # Regular expression to split the title and alt text
 ReTitleAlt = re.compile("""(?:"|')(?P<title>[^"']+)?(?:"|')\s+(?:"|')(?P<alt>[^"']+)?(?:"|')""")
 
+# Encoded payloads of this build, so that every image is only read (and
+# every remote image only revalidated) once however often it is used.
+_payloads = {}
+
+
+def _is_remote(src):
+    return '://' in src or src[0:2] == '//'
+
+
+def _cache_file(cache_dir, url):
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, 'liquid_tags_b64img', key + '.json')
+
+
+def _load_cached(cache_dir, url):
+    if not cache_dir:
+        return None
+    try:
+        with io.open(_cache_file(cache_dir, url), encoding='utf-8') as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+
 
-def _get_file(src):
-    """ Return content from local or remote file. """
+def _save_cached(cache_dir, url, entry):
+    if not cache_dir:
+        return
+    path = _cache_file(cache_dir, url)
     try:
-        if '://' in src or src[0:2] == '//':  # Most likely this is remote file
-            response = urllib2.urlopen(src)
-            return response.read()
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        # e.g. created by another prefetch thread meanwhile
+        if not os.path.isdir(os.path.dirname(path)):
+            raise
+    with io.open(path, 'w', encoding='utf-8') as fh:
+        fh.write(six.text_type(json.dumps(entry)))
+
+
+def _fetch_remote(src, cache_dir, timeout):
+    """ Return the encoded remote file, revalidating the cached copy. """
+    url = 'http:' + src if src[0:2] == '//' else src
+    cached = _load_cached(cache_dir, url)
+    request = Request(url)
+    if cached:
+        if cached.get('etag'):
+            request.add_header('If-None-Match', cached['etag'])
+        if cached.get('last_modified'):
+            request.add_header('If-Modified-Since', cached['last_modified'])
+    try:
+        response = urlopen(request, timeout=timeout)
+        payload = base64.b64encode(response.read()).decode('ascii')
+    except HTTPError as e:
+        if e.code == 304 and cached:
+            return cached['payload']
+        raise
+    except (URLError, IOError) as e:
+        if cached:
+            logger.warning('b64img: using cached copy of %s: %s', url, e)
+            return cached['payload']
+        raise
+    _save_cached(cache_dir, url, {
+        'payload': payload,
+        'etag': response.info().get('ETag'),
+        'last_modified': response.info().get('Last-Modified')})
+    return payload
+
+
+def base64image(src, cache_dir=None, timeout=None):
+    """ Generate base64 encoded image from source file. """
+    try:
+        if _is_remote(src):
+            key = src
+        else:
+            stat = os.stat(src)
+            key = (src, stat.st_mtime, stat.st_size)
+        if key in _payloads:
+            return _payloads[key]
+        if _is_remote(src):
+            payload = _fetch_remote(src, cache_dir, timeout)
         else:
             with open(src, 'rb') as fh:
-                return fh.read()
+                payload = base64.b64encode(fh.read()).decode('ascii')
     except Exception as e:
         raise RuntimeError('Error generating base64image: {}'.format(e))
-
-
-def base64image(src):
-    """ Generate base64 encoded image from srouce file. """
-    return base64.b64encode(_get_file(src))
+    _payloads[key] = payload
+    return payload
+
+
+def find_remote_sources(content_path):
+    """ Return the remote sources of all b64img tags in the content. """
+    sources = set()
+    for markup in find_tags(content_path, 'b64img'):
+        match = ReImg.search(markup)
+        if match and _is_remote(match.group('src')):
+            sources.add(match.group('src'))
+    return sources
+
+
+def prefetch_remote_images(pelican):
+    """ Fetch all remote b64img sources of the content concurrently. """
+    settings = pelican.settings
+    sources = sorted(find_remote_sources(settings['PATH']))
+    if not sources:
+        return
+    cache_dir = settings.get('CACHE_PATH', LT_CONFIG['CACHE_PATH'])
+    timeout = settings.get('B64IMG_TIMEOUT', LT_CONFIG['B64IMG_TIMEOUT'])
+
+    def fetch(src):
+        try:
+            base64image(src, cache_dir, timeout)
+        except RuntimeError as e:
+            # reported again by the tag, with the page it is used in
+            logger.warning('b64img: could not prefetch %s: %s', src, e)
+
+    pool = ThreadPool(settings.get('B64IMG_FETCH_THREADS', 8))
+    try:
+        pool.map(fetch, sources)
+    finally:
+        pool.close()
+        pool.join()
 
 
 @LiquidTags.register('b64img')
@@ -76,7 +192,18 @@ def b64img(preprocessor, tag, markup):
         if not attrs.get('alt'):
             attrs['alt'] = attrs['title']
 
-    attrs['src'] = 'data:;base64,{}'.format(base64image(attrs['src']))
+    payload = base64image(attrs['src'],
+                          preprocessor.configs.getConfig('CACHE_PATH'),
+                          preprocessor.configs.getConfig('B64IMG_TIMEOUT'))
+    attrs['src'] = 'data:;base64,{}'.format(payload)
+
+    # warn when the inlined images make the page too big
+    max_size = preprocessor.configs.getConfig('B64IMG_MAX_PAGE_SIZE')
+    page_size = preprocessor.state.get('b64img_size', 0)
+    preprocessor.state['b64img_size'] = page_size + len(payload)
+    if max_size and page_size <= max_size < page_size + len(payload):
+        logger.warning('b64img: inlined images exceed %d bytes in one page '
+                       'with {%% b64img %s %%}', max_size, markup)
 
     # Return the formatted text
     return "<img {0}>".format(' '.join('{0}="{1}"'.format(key, val)
@@ -85,4 +212,15 @@ def b64img(preprocessor, tag, markup):
 
 #----------------------------------------------------------------------
 # This import allows image tag to be a Pelican plugin
-from .liquid_tags import register
+from .liquid_tags import register as register_liquid_tags
+
+
+def clear_payloads(pelican):
+    # the next build (e.g. with --autoreload) revalidates remote images
+    _payloads.clear()
+
+
+def register():
+    register_liquid_tags()
+    signals.initialized.connect(prefetch_remote_images)
+    signals.finalized.connect(clear_payloads)
@@ -35,7 +35,7 @@ ReImg = re.compile("""(?P<class>\S.*\s+)?(?P<src>(?:https?:\/\/|\/|\S+\/)\S+)(?:
 ReTitleAlt = re.compile("""(?:"|')(?P<title>[^"']+)?(?:"|')\s+(?:"|')(?P<alt>[^"']+)?(?:"|')""")
 
 
-@LiquidTags.register('img')
+@LiquidTags.register('img', pure=True)
 def img(preprocessor, tag, markup):
     attrs = None
 
@@ -31,7 +31,9 @@ in the STATIC_PATHS setting, e.g.:
 """
 import re
 import os
-from .mdx_liquid_tags import LiquidTags
+import io
+from collections import OrderedDict
+from .mdx_liquid_tags import LiquidTags, TAG_CACHE
 
 
 SYNTAX = "{% include_code /path/to/code.py [lang:python] [lines:X-Y] [:hidefilename:] [title] %}"
@@ -49,9 +51,73 @@ FORMAT = re.compile(r"""
 """, re.VERBOSE)
 
 
-@LiquidTags.register('include_code')
-def include_code(preprocessor, tag, markup):
+class CodeFileCache(object):
+    """Per build cache of included files.
+
+    Every file is kept with the offsets of its line starts, so any range of
+    lines is sliced without reading or splitting the file again.  Entries
+    are invalidated when the mtime or size of the file change, and the
+    least recently used files are evicted above ``max_chars`` characters.
+    """
+    def __init__(self, max_chars=32 * 1024 * 1024):
+        self.max_chars = max_chars
+        self.size = 0
+        self.files = OrderedDict()
+
+    def get(self, path):
+        """Return the text of the file and the offsets of its lines"""
+        stat = os.stat(path)
+        signature = (stat.st_mtime, stat.st_size)
+        entry = self.files.pop(path, None)
+        if entry is not None and entry[0] != signature:
+            self.size -= len(entry[1])
+            entry = None
+        if entry is None:
+            with io.open(path) as fh:
+                text = fh.read()
+            offsets = [0] + [m.end() for m in re.finditer('\n', text)]
+            if offsets[-1] == len(text):
+                # no partial line after the last newline
+                offsets.pop()
+            entry = (signature, text, offsets)
+            self.size += len(text)
+            while self.files and self.size > self.max_chars:
+                evicted = self.files.popitem(last=False)[1]
+                self.size -= len(evicted[1])
+        self.files[path] = entry
+        return entry[1], entry[2]
+
+    def read(self, path):
+        return self.get(path)[0]
+
+    def read_lines(self, path, first_line, last_line):
+        """Return lines first_line to last_line (1-based, inclusive),
+        without the trailing whitespace of the last line"""
+        text, offsets = self.get(path)
+        lines = offsets[first_line - 1:last_line]
+        if not lines:
+            raise ValueError("Lines {0}-{1} are not in {2}".format(
+                first_line, last_line, path))
+        if last_line < len(offsets):
+            end = offsets[last_line]
+        else:
+            end = len(text)
+        return text[lines[0]:lines[-1]] + text[lines[-1]:end].rstrip()
+
+    def clear(self):
+        self.files.clear()
+        self.size = 0
+
+
+CODE_FILES = CodeFileCache()
+
+
+def render_code(code_dir, markup):
+    """Return the opening figure html, the code block and the closing html.
 
+    This only depends on the markup and the included file, so the result
+    is memoized across pages; the html is stashed by the tag itself.
+    """
     title = None
     lang = None
     src = None
@@ -71,19 +137,15 @@ def include_code(preprocessor, tag, markup):
         raise ValueError("Error processing input, "
                          "expected syntax: {0}".format(SYNTAX))
 
-    code_dir = preprocessor.configs.getConfig('CODE_DIR')
     code_path = os.path.join('content', code_dir, src)
 
     if not os.path.exists(code_path):
         raise ValueError("File {0} could not be found".format(code_path))
 
-    with open(code_path) as fh:
-        if lines:
-            code = fh.readlines()[first_line - 1: last_line]
-            code[-1] = code[-1].rstrip()
-            code = "".join(code)
-        else:
-            code = fh.read()
+    if lines:
+        code = CODE_FILES.read_lines(code_path, first_line, last_line)
+    else:
+        code = CODE_FILES.read(code_path)
 
     if not title and hide_filename:
         raise ValueError("Either title must be specified or filename must "
@@ -103,23 +165,41 @@ def include_code(preprocessor, tag, markup):
                                                                    url=url))
     close_tag = "</figure>"
 
-    # store HTML tags in the stash.  This prevents them from being
-    # modified by markdown.
-    open_tag = preprocessor.configs.htmlStash.store(open_tag, safe=True)
-    close_tag = preprocessor.configs.htmlStash.store(close_tag, safe=True)
-
     if lang:
         lang_include = ':::' + lang + '\n    '
     else:
         lang_include = ''
 
-    source = (open_tag
-              + '\n\n    '
-              + lang_include
-              + '\n    '.join(code.split('\n')) + '\n\n'
-              + close_tag + '\n')
+    code = ('\n\n    '
+            + lang_include
+            + '\n    '.join(code.split('\n')) + '\n\n')
+
+    return open_tag, code, close_tag
+
+
+def code_mtime(code_dir, markup):
+    """The modification time of the included file, None if it is missing"""
+    match = FORMAT.search(markup)
+    if match and match.group('src'):
+        code_path = os.path.join('content', code_dir, match.group('src'))
+        if os.path.exists(code_path):
+            return os.path.getmtime(code_path)
+    return None
+
+
+@LiquidTags.register('include_code')
+def include_code(preprocessor, tag, markup):
+    code_dir = preprocessor.configs.getConfig('CODE_DIR')
+    key = (tag, markup, code_dir, code_mtime(code_dir, markup))
+    open_tag, code, close_tag = TAG_CACHE.get(
+        tag, key, lambda: render_code(code_dir, markup))
+
+    # store HTML tags in the stash.  This prevents them from being
+    # modified by markdown.
+    open_tag = preprocessor.configs.htmlStash.store(open_tag, safe=True)
+    close_tag = preprocessor.configs.htmlStash.store(close_tag, safe=True)
 
-    return source
+    return open_tag + code + close_tag + '\n'
 
 
 #----------------------------------------------------------------------
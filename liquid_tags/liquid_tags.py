@@ -1,5 +1,9 @@
+import logging
+
 from pelican import signals
-from .mdx_liquid_tags import LiquidTags, LT_CONFIG
+from .mdx_liquid_tags import LiquidTags, LT_CONFIG, TAG_CACHE
+
+logger = logging.getLogger(__name__)
 
 
 def addLiquidTags(gen):
@@ -17,5 +21,20 @@ def addLiquidTags(gen):
         gen.settings['MD_EXTENSIONS'].append(LiquidTags(configs))
 
 
+def reportTagCache(pelican):
+    for tag, hits, misses in TAG_CACHE.stats():
+        logger.info("liquid_tags: '%s' cache hit rate %d/%d (%.0f%%)",
+                    tag, hits, hits + misses, 100. * hits / (hits + misses))
+    TAG_CACHE.clear()
+
+
+def clearCodeFiles(pelican):
+    # the next build (e.g. with --autoreload) must not keep stale files
+    from .include_code import CODE_FILES
+    CODE_FILES.clear()
+
+
 def register():
     signals.initialized.connect(addLiquidTags)
+    signals.finalized.connect(reportTagCache)
+    signals.finalized.connect(clearCodeFiles)
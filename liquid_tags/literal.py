@@ -17,7 +17,7 @@ liquid-style tag.
 """
 from .mdx_liquid_tags import LiquidTags
 
-@LiquidTags.register('literal')
+@LiquidTags.register('literal', pure=True)
 def literal(preprocessor, tag, markup):
     return '{%% %s %%}' % markup
 
@@ -11,47 +11,114 @@ either markdown or html.
 """
 import warnings
 import markdown
-import itertools
 import re
 import os
+import io
+import importlib
+from collections import OrderedDict
 from functools import wraps
 
 # Define some regular expressions
 LIQUID_TAG = re.compile(r'\{%.*?%\}')
 EXTRACT_TAG = re.compile(r'(?:\s*)(\S+)(?:\s*)')
+MARKDOWN_EXTENSIONS = ('.md', '.markdown', '.mkd', '.mdown')
 LT_CONFIG = { 'CODE_DIR': 'code',
-              'NOTEBOOK_DIR': 'notebooks'
+              'NOTEBOOK_DIR': 'notebooks',
+              'CACHE_PATH': 'cache',
+              'B64IMG_TIMEOUT': 10,
+              'B64IMG_MAX_PAGE_SIZE': 512 * 1024
 }
 LT_HELP = { 'CODE_DIR' : 'Code directory for include_code subplugin', 
-            'NOTEBOOK_DIR' : 'Notebook directory for notebook subplugin'
+            'NOTEBOOK_DIR' : 'Notebook directory for notebook subplugin',
+            'CACHE_PATH' : 'Cache directory for rendered notebooks and images',
+            'B64IMG_TIMEOUT' : 'Timeout in seconds for remote b64img images',
+            'B64IMG_MAX_PAGE_SIZE' : 'Warn when b64img inlines more bytes in a page'
 }
 
+
+
+class _TagCache(object):
+    """Bounded LRU of tag outputs shared by all pages of a build"""
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = {}
+        self.misses = {}
+
+    def get(self, tag, key, compute):
+        """Return the output cached under ``key``, calling ``compute()``
+        to create it when it is not cached yet"""
+        try:
+            value = self.entries.pop(key)
+            self.hits[tag] = self.hits.get(tag, 0) + 1
+        except KeyError:
+            value = compute()
+            self.misses[tag] = self.misses.get(tag, 0) + 1
+            if len(self.entries) >= self.maxsize:
+                self.entries.popitem(last=False)
+        self.entries[key] = value
+        return value
+
+    def stats(self):
+        """Return (tag, hits, misses) for every tag that was looked up"""
+        tags = sorted(set(self.hits) | set(self.misses))
+        return [(tag, self.hits.get(tag, 0), self.misses.get(tag, 0))
+                for tag in tags]
+
+    def clear(self):
+        self.entries.clear()
+        self.hits.clear()
+        self.misses.clear()
+
+
+TAG_CACHE = _TagCache()
+
+
 class _LiquidTagsPreprocessor(markdown.preprocessors.Preprocessor):
     _tags = {}
+    # tags whose output only depends on the markup
+    _pure_tags = set()
+    # tag -> name of the module implementing it, imported on first use
+    _lazy_tags = {}
     def __init__(self, configs):
         self.configs = configs
+        self.state = {}
+
+    def expand(self, match):
+        # remove {% %}
+        markup = match.group()[2:-2]
+        tag = EXTRACT_TAG.match(markup).groups()[0]
+        markup = EXTRACT_TAG.sub('', markup, 1)
+        if tag not in self._tags and tag in self._lazy_tags:
+            # importing the module registers the tag; the entry is only
+            # dropped once that worked, so a failed import fails every tag
+            importlib.import_module(self._lazy_tags[tag])
+            del self._lazy_tags[tag]
+        if tag not in self._tags:
+            return match.group()
+        markup = markup.strip()
+        func = self._tags[tag]
+        if tag not in self._pure_tags:
+            return func(self, tag, markup)
+        return TAG_CACHE.get(tag, (tag, markup),
+                             lambda: func(self, tag, markup))
 
     def run(self, lines):
-        page = '\n'.join(lines)
-        liquid_tags = LIQUID_TAG.findall(page)
-
-        for i, markup in enumerate(liquid_tags):
-            # remove {% %}
-            markup = markup[2:-2]
-            tag = EXTRACT_TAG.match(markup).groups()[0]
-            markup = EXTRACT_TAG.sub('', markup, 1)
-            if tag in self._tags:
-                liquid_tags[i] = self._tags[tag](self, tag, markup.strip())
-                
-        # add an empty string to liquid_tags so that chaining works
-        liquid_tags.append('')
- 
-        # reconstruct string
-        page = ''.join(itertools.chain(*zip(LIQUID_TAG.split(page),
-                                            liquid_tags)))
-
-        # resplit the lines
-        return page.split("\n")
+        # per document scratch space for the tags
+        self.state = {}
+
+        # tags never span lines, so only lines holding a tag marker have to
+        # be touched and the page is never joined and resplit as a whole.
+        if not any('{%' in line for line in lines):
+            return lines
+
+        new_lines = []
+        for line in lines:
+            if '{%' not in line:
+                new_lines.append(line)
+                continue
+            new_lines.extend(LIQUID_TAG.sub(self.expand, line).split("\n"))
+        return new_lines
 
 
 class LiquidTags(markdown.Extension):
@@ -69,15 +136,34 @@ class LiquidTags(markdown.Extension):
             super(LiquidTags,self).__init__(config)
 
     @classmethod
-    def register(cls, tag):
-        """Decorator to register a new include tag"""
+    def register(cls, tag, pure=False):
+        """Decorator to register a new include tag
+
+        A ``pure`` tag returns the same output for the same markup, so its
+        output is memoized for the whole build.
+        """
         def dec(func):
             if tag in _LiquidTagsPreprocessor._tags:
                 warnings.warn("Enhanced Markdown: overriding tag '%s'" % tag)
             _LiquidTagsPreprocessor._tags[tag] = func
+            _LiquidTagsPreprocessor._lazy_tags.pop(tag, None)
+            if pure:
+                _LiquidTagsPreprocessor._pure_tags.add(tag)
+            else:
+                _LiquidTagsPreprocessor._pure_tags.discard(tag)
             return func
         return dec
 
+    @classmethod
+    def register_lazy(cls, tag, module):
+        """Register a tag implemented in ``module`` without importing it
+
+        The module is imported when the tag is first used, and has to
+        register the tag with ``LiquidTags.register``.
+        """
+        if tag not in _LiquidTagsPreprocessor._tags:
+            _LiquidTagsPreprocessor._lazy_tags[tag] = module
+
     def extendMarkdown(self, md, md_globals):
         self.htmlStash = md.htmlStash
         md.registerExtension(self)
@@ -89,6 +175,24 @@ class LiquidTags(markdown.Extension):
                              _LiquidTagsPreprocessor(self), ">html_block")
 
 
+def find_tags(content_path, tag):
+    """Yield the markup of every ``tag`` tag in the markdown content
+
+    Lets a tag find its work up front, e.g. to do it concurrently, before
+    the content is read.
+    """
+    tag_re = re.compile(r'\{%\s*' + re.escape(tag) + r'\s+(.*?)%\}')
+    for dirpath, dirnames, filenames in os.walk(content_path):
+        for filename in filenames:
+            if not filename.endswith(MARKDOWN_EXTENSIONS):
+                continue
+            with io.open(os.path.join(dirpath, filename),
+                         encoding='utf-8', errors='replace') as f:
+                text = f.read()
+            for markup in tag_re.findall(text):
+                yield markup
+
+
 def makeExtension(configs=None):
     """Wrapper for a MarkDown extension"""
     return LiquidTags(configs=configs)
@@ -46,187 +46,15 @@ still be some conflicts.
 """
 import re
 import os
-from functools import partial
+import io
+import logging
+import multiprocessing
 
-from .mdx_liquid_tags import LiquidTags
+from pelican import signals
 
-from distutils.version import LooseVersion
-import IPython
-if not LooseVersion(IPython.__version__) >= '1.0':
-    raise ValueError("IPython version 1.0+ required for notebook tag")
+from .mdx_liquid_tags import LiquidTags, LT_CONFIG, find_tags
 
-from IPython import nbconvert
-
-try:
-    from IPython.nbconvert.filters.highlight import _pygments_highlight
-except ImportError:
-    # IPython < 2.0
-    from IPython.nbconvert.filters.highlight import _pygment_highlight as _pygments_highlight
-
-from pygments.formatters import HtmlFormatter
-
-from IPython.nbconvert.exporters import HTMLExporter
-from IPython.config import Config
-
-from IPython.nbformat import current as nbformat
-
-try:
-    from IPython.nbconvert.preprocessors import Preprocessor
-except ImportError:
-    # IPython < 2.0
-    from IPython.nbconvert.transformers import Transformer as Preprocessor
-
-from IPython.utils.traitlets import Integer
-from copy import deepcopy
-
-from jinja2 import DictLoader
-
-
-#----------------------------------------------------------------------
-# Some code that will be added to the header:
-#  Some of the following javascript/css include is adapted from
-#  IPython/nbconvert/templates/fullhtml.tpl, while some are custom tags
-#  specifically designed to make the results look good within the
-#  pelican-octopress theme.
-JS_INCLUDE = r"""
-<style type="text/css">
-/* Overrides of notebook CSS for static HTML export */
-div.entry-content {
-  overflow: visible;
-  padding: 8px;
-}
-.input_area {
-  padding: 0.2em;
-}
-
-a.heading-anchor {
- white-space: normal;
-}
-
-.rendered_html
-code {
- font-size: .8em;
-}
-
-pre.ipynb {
-  color: black;
-  background: #f7f7f7;
-  border: none;
-  box-shadow: none;
-  margin-bottom: 0;
-  padding: 0;
-  margin: 0px;
-  font-size: 13px;
-}
-
-/* remove the prompt div from text cells */
-div.text_cell .prompt {
-    display: none;
-}
-
-/* remove horizontal padding from text cells, */
-/* so it aligns with outer body text */
-div.text_cell_render {
-    padding: 0.5em 0em;
-}
-
-img.anim_icon{padding:0; border:0; vertical-align:middle; -webkit-box-shadow:none; -box-shadow:none}
-
-div.collapseheader {
-    width=100%;
-    background-color:#d3d3d3;
-    padding: 2px;
-    cursor: pointer;
-    font-family:"Helvetica Neue",Helvetica,Arial,sans-serif;
-}
-</style>
-
-<script src="https://cdn.mathjax.org/mathjax/latest/MathJax.js?config=TeX-AMS_HTML" type="text/javascript"></script>
-<script type="text/javascript">
-init_mathjax = function() {
-    if (window.MathJax) {
-        // MathJax loaded
-        MathJax.Hub.Config({
-            tex2jax: {
-                inlineMath: [ ['$','$'], ["\\(","\\)"] ],
-                displayMath: [ ['$$','$$'], ["\\[","\\]"] ]
-            },
-            displayAlign: 'left', // Change this to 'center' to center equations.
-            "HTML-CSS": {
-                styles: {'.MathJax_Display': {"margin": 0}}
-            }
-        });
-        MathJax.Hub.Queue(["Typeset",MathJax.Hub]);
-    }
-}
-init_mathjax();
-</script>
-<script src="https://ajax.googleapis.com/ajax/libs/jquery/1.10.2/jquery.min.js"></script>
-
-<script type="text/javascript">
-jQuery(document).ready(function($) {
-    $("div.collapseheader").click(function () {
-    $header = $(this).children("span").first();
-    $codearea = $(this).children(".input_area");
-    console.log($(this).children());
-    $codearea.slideToggle(500, function () {
-        $header.text(function () {
-            return $codearea.is(":visible") ? "Collapse Code" : "Expand Code";
-        });
-    });
-});
-});
-</script>
-
-"""
-
-CSS_WRAPPER = """
-<style type="text/css">
-{0}
-</style>
-"""
-
-
-#----------------------------------------------------------------------
-# Create a custom preprocessor
-class SliceIndex(Integer):
-    """An integer trait that accepts None"""
-    default_value = None
-
-    def validate(self, obj, value):
-        if value is None:
-            return value
-        else:
-            return super(SliceIndex, self).validate(obj, value)
-
-
-class SubCell(Preprocessor):
-    """A transformer to select a slice of the cells of a notebook"""
-    start = SliceIndex(0, config=True,
-                       help="first cell of notebook to be converted")
-    end = SliceIndex(None, config=True,
-                     help="last cell of notebook to be converted")
-
-    def preprocess(self, nb, resources):
-        nbc = deepcopy(nb)
-        for worksheet in nbc.worksheets:
-            cells = worksheet.cells[:]
-            worksheet.cells = cells[self.start:self.end]
-        return nbc, resources
-
-    call = preprocess # IPython < 2.0
-
-
-
-#----------------------------------------------------------------------
-# Custom highlighter:
-#  instead of using class='highlight', use class='highlight-ipynb'
-def custom_highlighter(source, language='ipython', metadata=None):
-    formatter = HtmlFormatter(cssclass='highlight-ipynb')
-    if not language:
-        language = 'ipython'
-    output = _pygments_highlight(source, formatter, language)
-    return output.replace('<pre>', '<pre class="ipynb">')
+logger = logging.getLogger(__name__)
 
 
 #----------------------------------------------------------------------
@@ -236,18 +64,12 @@ SYNTAX = "{% notebook /path/to/notebook.ipynb [ cells[start:end] ] [ language[la
 FORMAT = re.compile(r"""^(\s+)?(?P<src>\S+)(\s+)?((cells\[)(?P<start>-?[0-9]*):(?P<end>-?[0-9]*)(\]))?(\s+)?((language\[)(?P<language>-?[a-z0-9\+\-]*)(\]))?(\s+)?$""")
 
 
-@LiquidTags.register('notebook')
-def notebook(preprocessor, tag, markup):
-    match = FORMAT.search(markup)
-    if match:
-        argdict = match.groupdict()
-        src = argdict['src']
-        start = argdict['start']
-        end = argdict['end']
-        language = argdict['language']
-    else:
-        raise ValueError("Error processing input, "
-                         "expected syntax: {0}".format(SYNTAX))
+def parse_notebook_args(match):
+    argdict = match.groupdict()
+    src = argdict['src']
+    start = argdict['start']
+    end = argdict['end']
+    language = argdict['language']
 
     if start:
         start = int(start)
@@ -259,65 +81,82 @@ def notebook(preprocessor, tag, markup):
     else:
         end = None
 
-    language_applied_highlighter = partial(custom_highlighter, language=language)
+    return src, start, end, language
 
-    nb_dir =  preprocessor.configs.getConfig('NOTEBOOK_DIR')
-    nb_path = os.path.join('content', nb_dir, src)
 
-    if not os.path.exists(nb_path):
-        raise ValueError("File {0} could not be found".format(nb_path))
+# The implementation imports IPython and nbconvert, which takes a long time,
+# so it is only imported when the first notebook tag is found.
+LiquidTags.register_lazy('notebook', __name__.rpartition('.')[0] + '.notebook_render')
 
-    # Create the custom notebook converter
-    c = Config({'CSSHTMLHeaderTransformer':
-                    {'enabled':True, 'highlight_class':'.highlight-ipynb'},
-                'SubCell':
-                    {'enabled':True, 'start':start, 'end':end}})
 
-    template_file = 'basic'
-    if LooseVersion(IPython.__version__) >= '2.0':
-        if os.path.exists('pelicanhtml_2.tpl'):
-            template_file = 'pelicanhtml_2'
-    else:
-        if os.path.exists('pelicanhtml_1.tpl'):
-            template_file = 'pelicanhtml_1'
-
-    if LooseVersion(IPython.__version__) >= '2.0':
-        subcell_kwarg = dict(preprocessors=[SubCell])
-    else:
-        subcell_kwarg = dict(transformers=[SubCell])
-    
-    exporter = HTMLExporter(config=c,
-                            template_file=template_file,
-                            filters={'highlight2html': language_applied_highlighter},
-                            **subcell_kwarg)
-
-    # read and parse the notebook
-    with open(nb_path) as f:
-        nb_text = f.read()
-    nb_json = nbformat.reads_json(nb_text)
-    (body, resources) = exporter.from_notebook_node(nb_json)
-
-    # if we haven't already saved the header, save it here.
-    if not notebook.header_saved:
-        print ("\n ** Writing styles to _nb_header.html: "
-               "this should be included in the theme. **\n")
-
-        header = '\n'.join(CSS_WRAPPER.format(css_line)
-                           for css_line in resources['inlining']['css'])
-        header += JS_INCLUDE
-
-        with open('_nb_header.html', 'w') as f:
-            f.write(header)
-        notebook.header_saved = True
-
-    # this will stash special characters so that they won't be transformed
-    # by subsequent processes.
-    body = preprocessor.configs.htmlStash.store(body, safe=True)
-    return body
-
-notebook.header_saved = False
+#----------------------------------------------------------------------
+# Notebooks are converted one at a time while the markdown is read.  To use
+# all cores, every notebook tag in the content is found up front and the
+# notebooks are converted in a process pool, filling the render cache; the
+# tags themselves then only read the cache.
+def _prerender(args):
+    from .notebook_render import cached_render
+    try:
+        cached_render(*args)
+    except Exception as e:
+        return '{0}: {1}'.format(args[0], e)
+
+
+def prerender_notebooks(pelican):
+    settings = pelican.settings
+    if not settings.get('NOTEBOOK_PRERENDER', True):
+        return
+    nb_dir = settings.get('NOTEBOOK_DIR', LT_CONFIG['NOTEBOOK_DIR'])
+    cache_dir = settings.get('CACHE_PATH', LT_CONFIG['CACHE_PATH'])
+
+    tags = set()
+    for markup in find_tags(settings['PATH'], 'notebook'):
+        match = FORMAT.search(markup)
+        if not match:
+            continue
+        src, start, end, language = parse_notebook_args(match)
+        nb_path = os.path.join('content', nb_dir, src)
+        if os.path.exists(nb_path):
+            tags.add((nb_path, start, end, language))
+    if not tags:
+        # do not import nbconvert for a site without notebooks
+        return
+
+    from .notebook_render import get_template_file, render_key, \
+        render_cache_path
+    template_file = get_template_file()
+
+    jobs = set()
+    for nb_path, start, end, language in tags:
+        with open(nb_path, 'rb') as f:
+            key = render_key(f.read(), start, end, language, template_file)
+        if not os.path.exists(render_cache_path(cache_dir, key)):
+            jobs.add((nb_path, start, end, language, template_file, cache_dir))
+
+    if len(jobs) < 2:
+        # not worth starting a pool, the tag renders it
+        return
+    cache_subdir = os.path.dirname(render_cache_path(cache_dir, ''))
+    if cache_dir and not os.path.isdir(cache_subdir):
+        # before the processes, which would race to create it
+        os.makedirs(cache_subdir)
+
+    logger.info('Converting %d notebooks in parallel', len(jobs))
+    pool = multiprocessing.Pool(settings.get('NOTEBOOK_PRERENDER_PROCESSES'))
+    try:
+        for error in pool.imap_unordered(_prerender, sorted(jobs, key=repr)):
+            if error:
+                logger.warning('Could not pre-render notebook %s', error)
+    finally:
+        pool.close()
+        pool.join()
 
 
 #----------------------------------------------------------------------
 # This import allows notebook to be a Pelican plugin
-from liquid_tags import register
+from .liquid_tags import register as register_liquid_tags
+
+
+def register():
+    register_liquid_tags()
+    signals.initialized.connect(prerender_notebooks)
@@ -0,0 +1,320 @@
+"""
+Notebook Tag Rendering
+----------------------
+The implementation of the ``notebook`` tag, see ``notebook.py``.
+
+This module imports IPython, nbconvert and pygments, which is slow, so it is
+only imported when the first notebook tag is found in the content.
+"""
+import os
+import io
+import json
+import hashlib
+import logging
+import tempfile
+from functools import partial
+
+from .mdx_liquid_tags import LiquidTags
+from .notebook import FORMAT, SYNTAX, parse_notebook_args
+
+from distutils.version import LooseVersion
+import IPython
+if not LooseVersion(IPython.__version__) >= '1.0':
+    raise ValueError("IPython version 1.0+ required for notebook tag")
+
+from IPython import nbconvert
+
+try:
+    from IPython.nbconvert.filters.highlight import _pygments_highlight
+except ImportError:
+    # IPython < 2.0
+    from IPython.nbconvert.filters.highlight import _pygment_highlight as _pygments_highlight
+
+from pygments.formatters import HtmlFormatter
+
+from IPython.nbconvert.exporters import HTMLExporter
+from IPython.config import Config
+
+from IPython.nbformat import current as nbformat
+
+from copy import deepcopy
+
+from jinja2 import DictLoader
+
+logger = logging.getLogger(__name__)
+
+#----------------------------------------------------------------------
+# Some code that will be added to the header:
+#  Some of the following javascript/css include is adapted from
+#  IPython/nbconvert/templates/fullhtml.tpl, while some are custom tags
+#  specifically designed to make the results look good within the
+#  pelican-octopress theme.
+JS_INCLUDE = r"""
+<style type="text/css">
+/* Overrides of notebook CSS for static HTML export */
+div.entry-content {
+  overflow: visible;
+  padding: 8px;
+}
+.input_area {
+  padding: 0.2em;
+}
+
+a.heading-anchor {
+ white-space: normal;
+}
+
+.rendered_html
+code {
+ font-size: .8em;
+}
+
+pre.ipynb {
+  color: black;
+  background: #f7f7f7;
+  border: none;
+  box-shadow: none;
+  margin-bottom: 0;
+  padding: 0;
+  margin: 0px;
+  font-size: 13px;
+}
+
+/* remove the prompt div from text cells */
+div.text_cell .prompt {
+    display: none;
+}
+
+/* remove horizontal padding from text cells, */
+/* so it aligns with outer body text */
+div.text_cell_render {
+    padding: 0.5em 0em;
+}
+
+img.anim_icon{padding:0; border:0; vertical-align:middle; -webkit-box-shadow:none; -box-shadow:none}
+
+div.collapseheader {
+    width=100%;
+    background-color:#d3d3d3;
+    padding: 2px;
+    cursor: pointer;
+    font-family:"Helvetica Neue",Helvetica,Arial,sans-serif;
+}
+</style>
+
+<script src="https://cdn.mathjax.org/mathjax/latest/MathJax.js?config=TeX-AMS_HTML" type="text/javascript"></script>
+<script type="text/javascript">
+init_mathjax = function() {
+    if (window.MathJax) {
+        // MathJax loaded
+        MathJax.Hub.Config({
+            tex2jax: {
+                inlineMath: [ ['$','$'], ["\\(","\\)"] ],
+                displayMath: [ ['$$','$$'], ["\\[","\\]"] ]
+            },
+            displayAlign: 'left', // Change this to 'center' to center equations.
+            "HTML-CSS": {
+                styles: {'.MathJax_Display': {"margin": 0}}
+            }
+        });
+        MathJax.Hub.Queue(["Typeset",MathJax.Hub]);
+    }
+}
+init_mathjax();
+</script>
+<script src="https://ajax.googleapis.com/ajax/libs/jquery/1.10.2/jquery.min.js"></script>
+
+<script type="text/javascript">
+jQuery(document).ready(function($) {
+    $("div.collapseheader").click(function () {
+    $header = $(this).children("span").first();
+    $codearea = $(this).children(".input_area");
+    console.log($(this).children());
+    $codearea.slideToggle(500, function () {
+        $header.text(function () {
+            return $codearea.is(":visible") ? "Collapse Code" : "Expand Code";
+        });
+    });
+});
+});
+</script>
+
+"""
+
+CSS_WRAPPER = """
+<style type="text/css">
+{0}
+</style>
+"""
+
+
+#----------------------------------------------------------------------
+# Select the cells to convert
+def slice_cells(nb, start, end):
+    """Return a copy of the notebook with only the cells in [start:end]"""
+    nbc = deepcopy(nb)
+    for worksheet in nbc.worksheets:
+        cells = worksheet.cells[:]
+        worksheet.cells = cells[start:end]
+    return nbc
+
+
+#----------------------------------------------------------------------
+# Custom highlighter:
+#  instead of using class='highlight', use class='highlight-ipynb'
+def custom_highlighter(source, language='ipython', metadata=None):
+    formatter = HtmlFormatter(cssclass='highlight-ipynb')
+    if not language:
+        language = 'ipython'
+    output = _pygments_highlight(source, formatter, language)
+    return output.replace('<pre>', '<pre class="ipynb">')
+
+
+#----------------------------------------------------------------------
+# Exporters are expensive to create (they load the jinja templates), so a
+# single one is kept per template and language for the whole build.  The
+# cell slice is applied to the notebook before exporting instead of being
+# configured in the exporter.
+_exporters = {}
+
+
+def get_exporter(template_file, language):
+    key = (template_file, language)
+    if key not in _exporters:
+        c = Config({'CSSHTMLHeaderTransformer':
+                        {'enabled':True, 'highlight_class':'.highlight-ipynb'}})
+        highlighter = partial(custom_highlighter, language=language)
+        _exporters[key] = HTMLExporter(config=c,
+                                       template_file=template_file,
+                                       filters={'highlight2html': highlighter})
+    return _exporters[key]
+
+
+def get_template_file():
+    template_file = 'basic'
+    if LooseVersion(IPython.__version__) >= '2.0':
+        if os.path.exists('pelicanhtml_2.tpl'):
+            template_file = 'pelicanhtml_2'
+    else:
+        if os.path.exists('pelicanhtml_1.tpl'):
+            template_file = 'pelicanhtml_1'
+    return template_file
+
+
+def render_notebook(nb_text, start, end, language, template_file):
+    """Convert a notebook to html, returning the body and the css lines"""
+    exporter = get_exporter(template_file, language)
+    nb_json = slice_cells(nbformat.reads_json(nb_text), start, end)
+    (body, resources) = exporter.from_notebook_node(nb_json)
+    return body, list(resources['inlining']['css'])
+
+
+#----------------------------------------------------------------------
+# Rendered notebooks are cached on disk, keyed by everything the output
+# depends on, so unchanged notebooks skip nbconvert on the next build.
+def render_key(nb_bytes, start, end, language, template_file):
+    key = hashlib.sha1(nb_bytes)
+    key.update(repr((start, end, language, template_file,
+                     IPython.__version__)).encode('utf-8'))
+    template_path = template_file + '.tpl'
+    if os.path.exists(template_path):
+        with open(template_path, 'rb') as f:
+            key.update(f.read())
+    return key.hexdigest()
+
+
+def render_cache_path(cache_dir, key):
+    return os.path.join(cache_dir, 'liquid_tags_notebook', key + '.json')
+
+
+def load_render(cache_dir, key):
+    if not cache_dir:
+        return None
+    try:
+        with io.open(render_cache_path(cache_dir, key), encoding='utf-8') as f:
+            cached = json.load(f)
+        return cached['body'], cached['css']
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def save_render(cache_dir, key, body, css):
+    if not cache_dir:
+        return
+    path = render_cache_path(cache_dir, key)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    # pre-rendering processes may save the same notebook at once, so the
+    # file is written aside and then moved in place
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp',
+                                     dir=os.path.dirname(path))
+    try:
+        with io.open(fd, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'body': body, 'css': css}, ensure_ascii=False))
+        getattr(os, 'replace', os.rename)(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def cached_render(nb_path, start, end, language, template_file, cache_dir):
+    with open(nb_path, 'rb') as f:
+        nb_bytes = f.read()
+    key = render_key(nb_bytes, start, end, language, template_file)
+    cached = load_render(cache_dir, key)
+    if cached is not None:
+        return cached
+    body, css = render_notebook(nb_bytes.decode('utf-8'), start, end,
+                                language, template_file)
+    save_render(cache_dir, key, body, css)
+    return body, css
+
+
+def save_header(css):
+    header = '\n'.join(CSS_WRAPPER.format(css_line) for css_line in css)
+    header += JS_INCLUDE
+
+    if os.path.exists('_nb_header.html'):
+        with io.open('_nb_header.html', encoding='utf-8') as f:
+            if f.read() == header:
+                return
+
+    print ("\n ** Writing styles to _nb_header.html: "
+           "this should be included in the theme. **\n")
+    with io.open('_nb_header.html', 'w', encoding='utf-8') as f:
+        f.write(header)
+
+#----------------------------------------------------------------------
+# Below is the pelican plugin code.
+#
+@LiquidTags.register('notebook')
+def notebook(preprocessor, tag, markup):
+    match = FORMAT.search(markup)
+    if match:
+        src, start, end, language = parse_notebook_args(match)
+    else:
+        raise ValueError("Error processing input, "
+                         "expected syntax: {0}".format(SYNTAX))
+
+    nb_dir =  preprocessor.configs.getConfig('NOTEBOOK_DIR')
+    nb_path = os.path.join('content', nb_dir, src)
+
+    if not os.path.exists(nb_path):
+        raise ValueError("File {0} could not be found".format(nb_path))
+
+    template_file = get_template_file()
+    cache_dir = preprocessor.configs.getConfig('CACHE_PATH')
+    body, css = cached_render(nb_path, start, end, language, template_file,
+                              cache_dir)
+
+    # write the header, unless it is already up to date
+    if not notebook.header_saved:
+        save_header(css)
+        notebook.header_saved = True
+
+    # this will stash special characters so that they won't be transformed
+    # by subsequent processes.
+    body = preprocessor.configs.htmlStash.store(body, safe=True)
+    return body
+
+notebook.header_saved = False
@@ -0,0 +1,139 @@
+import os
+import logging
+import shutil
+import tempfile
+import threading
+
+from six.moves import BaseHTTPServer
+
+from pelican.tests.support import LogCountHandler, unittest
+
+from . import b64img
+from .mdx_liquid_tags import LT_CONFIG, _LiquidTagsPreprocessor
+
+
+class ImageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves /image.png with an ETag and counts the requests"""
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path.partition('?')[0] != '/image.png':
+            self.send_error(404)
+        elif self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            self.wfile.write(b'PNG DATA')
+
+    def log_message(self, *args):
+        pass
+
+
+class Configs(object):
+
+    def __init__(self, **config):
+        self.config = dict(LT_CONFIG, **config)
+
+    def getConfig(self, key):
+        return self.config[key]
+
+
+class TestB64Img(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ImageHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{0}/image.png'.format(
+            self.server.server_address[1])
+        self.cache_path = tempfile.mkdtemp()
+        ImageHandler.requests = []
+        b64img._payloads.clear()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_path)
+        b64img._payloads.clear()
+
+    def render(self, markup, **config):
+        config.setdefault('CACHE_PATH', self.cache_path)
+        preprocessor = _LiquidTagsPreprocessor(Configs(**config))
+        return b64img.b64img(preprocessor, 'b64img', markup)
+
+    def test_remote_image_is_fetched_once_per_build(self):
+        expected = '<img src="data:;base64,UE5HIERBVEE=">'
+        self.assertEqual(self.render(self.url), expected)
+        self.assertEqual(self.render(self.url), expected)
+        self.assertEqual(ImageHandler.requests, [('/image.png', None)])
+
+    def test_cached_remote_image_is_revalidated(self):
+        self.render(self.url)
+        b64img._payloads.clear()
+        self.assertEqual(self.render(self.url),
+                         '<img src="data:;base64,UE5HIERBVEE=">')
+        self.assertEqual(ImageHandler.requests,
+                         [('/image.png', None), ('/image.png', '"v1"')])
+
+    def test_missing_remote_image(self):
+        self.assertRaises(RuntimeError, self.render,
+                          self.url.replace('image', 'missing'))
+
+    def test_prefetch_remote_images(self):
+        content = os.path.join(self.cache_path, 'content')
+        os.makedirs(content)
+        with open(os.path.join(content, 'post.md'), 'w') as fh:
+            fh.write('{{% b64img {0} %}}\n{{% b64img left {0} Title %}}\n'
+                     '{{% b64img /local/image.png %}}\n'.format(self.url))
+
+        class Pelican(object):
+            settings = {'PATH': content, 'CACHE_PATH': self.cache_path}
+
+        b64img.prefetch_remote_images(Pelican())
+        self.assertEqual(ImageHandler.requests, [('/image.png', None)])
+        self.render(self.url)
+        self.assertEqual(len(ImageHandler.requests), 1)
+
+    def test_prefetch_on_cold_cache(self):
+        content = os.path.join(self.cache_path, 'content')
+        os.makedirs(content)
+        urls = ['{0}?{1}'.format(self.url, i) for i in range(16)]
+        with open(os.path.join(content, 'post.md'), 'w') as fh:
+            fh.write(''.join('{{% b64img {0} %}}\n'.format(url)
+                             for url in urls))
+
+        class Pelican(object):
+            settings = {'PATH': content, 'CACHE_PATH': self.cache_path}
+
+        handler = LogCountHandler()
+        b64img.logger.addHandler(handler)
+        try:
+            b64img.prefetch_remote_images(Pelican())
+        finally:
+            b64img.logger.removeHandler(handler)
+        self.assertEqual(handler.count_logs(level=logging.WARNING), 0)
+        for url in urls:
+            self.render(url)
+        self.assertEqual(len(ImageHandler.requests), 16)
+
+    def test_page_size_warning(self):
+        handler = LogCountHandler()
+        b64img.logger.addHandler(handler)
+        try:
+            self.render(self.url, B64IMG_MAX_PAGE_SIZE=4)
+        finally:
+            b64img.logger.removeHandler(handler)
+        self.assertEqual(handler.count_logs(level=logging.WARNING), 1)
+
+    def test_missing_local_image(self):
+        with self.assertRaises(RuntimeError):
+            self.render(os.path.join(self.cache_path, 'missing.png'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+
+from pelican.tests.support import unittest
+
+from . import include_code
+from .liquid_tags import clearCodeFiles
+
+
+class TestCodeFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.cache = include_code.CodeFileCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def write(self, name, text, mtime=1000):
+        path = os.path.join(self.temp_path, name)
+        with open(path, 'w') as fh:
+            fh.write(text)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_read_lines(self):
+        path = self.write('code.py', 'a = 1\nb = 2  \n\nc = 3')
+        self.assertEqual(self.cache.read(path), 'a = 1\nb = 2  \n\nc = 3')
+        self.assertEqual(self.cache.read_lines(path, 1, 2), 'a = 1\nb = 2')
+        self.assertEqual(self.cache.read_lines(path, 2, 3), 'b = 2  \n')
+        self.assertEqual(self.cache.read_lines(path, 3, 10), '\nc = 3')
+        self.assertRaises(ValueError, self.cache.read_lines, path, 5, 6)
+
+    def test_changed_file_is_read_again(self):
+        path = self.write('code.py', 'old\n')
+        self.assertEqual(self.cache.read(path), 'old\n')
+        self.write('code.py', 'new code\n', mtime=2000)
+        self.assertEqual(self.cache.read_lines(path, 1, 1), 'new code')
+
+    def test_least_recently_used_file_is_evicted(self):
+        self.cache.max_chars = 10
+        first = self.write('first.py', 'aaaa\n')
+        second = self.write('second.py', 'bbbb\n')
+        third = self.write('third.py', 'cccc\n')
+        self.cache.read(first)
+        self.cache.read(second)
+        self.cache.read(first)
+        self.cache.read(third)
+        self.assertEqual(list(self.cache.files), [first, third])
+        self.assertEqual(self.cache.size, 10)
+
+    def test_cleared_after_build(self):
+        path = self.write('a.py', 'a = 1\n')
+        include_code.CODE_FILES.read(path)
+        self.assertIn(path, include_code.CODE_FILES.files)
+        clearCodeFiles(None)
+        self.assertEqual(include_code.CODE_FILES.files, {})
+        self.assertEqual(include_code.CODE_FILES.size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+
+from pelican.tests.support import unittest
+
+from . import mdx_liquid_tags
+
+
+class TestLiquidTagsPreprocessor(unittest.TestCase):
+
+    def setUp(self):
+        self.tags = dict(mdx_liquid_tags._LiquidTagsPreprocessor._tags)
+        mdx_liquid_tags._LiquidTagsPreprocessor._tags['echo'] = (
+            lambda preprocessor, tag, markup: u'<p>{0}</p>\n<hr>'.format(markup))
+        self.preprocessor = mdx_liquid_tags._LiquidTagsPreprocessor(None)
+
+    def tearDown(self):
+        mdx_liquid_tags._LiquidTagsPreprocessor._tags = self.tags
+        mdx_liquid_tags._LiquidTagsPreprocessor._pure_tags.discard('count')
+        mdx_liquid_tags._LiquidTagsPreprocessor._lazy_tags.pop('broken', None)
+        mdx_liquid_tags.TAG_CACHE.clear()
+
+    def test_lines_without_tags_are_returned_untouched(self):
+        lines = [u'# Title', u'', u'Some {text} with 100% markdown']
+        self.assertIs(self.preprocessor.run(lines), lines)
+
+    def test_tag_output_is_spliced_into_lines(self):
+        lines = [u'before', u'a {% echo  some markup %} b', u'after']
+        self.assertEqual(self.preprocessor.run(lines),
+                         [u'before', u'a <p>some markup</p>', u'<hr> b',
+                          u'after'])
+
+    def test_several_tags_on_one_line(self):
+        lines = [u'{% echo 1 %}{% echo 2 %}']
+        self.assertEqual(self.preprocessor.run(lines),
+                         [u'<p>1</p>', u'<hr><p>2</p>', u'<hr>'])
+
+    def test_unknown_tags_are_kept(self):
+        lines = [u'x {% unknown tag %} y', u'{% echo z %}']
+        self.assertEqual(self.preprocessor.run(lines),
+                         [u'x {% unknown tag %} y', u'<p>z</p>', u'<hr>'])
+
+    def test_failed_lazy_import_fails_every_tag(self):
+        mdx_liquid_tags.LiquidTags.register_lazy(
+            'broken', 'liquid_tags_missing_module')
+        for _ in range(2):
+            with self.assertRaises(ImportError):
+                self.preprocessor.run([u'{% broken tag %}'])
+
+    def test_pure_tags_are_memoized(self):
+        calls = []
+
+        @mdx_liquid_tags.LiquidTags.register('count', pure=True)
+        def count(preprocessor, tag, markup):
+            calls.append(markup)
+            return u'{0}:{1}'.format(markup, len(calls))
+
+        lines = [u'{% count a %} {% count b %} {% count a %}']
+        self.assertEqual(self.preprocessor.run(lines), [u'a:1 b:2 a:1'])
+        self.assertEqual(calls, [u'a', u'b'])
+        self.assertEqual(mdx_liquid_tags.TAG_CACHE.stats(), [(u'count', 1, 2)])
+
+
+class TestTagCache(unittest.TestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = mdx_liquid_tags._TagCache(maxsize=2)
+        cache.get('t', 'a', lambda: 1)
+        cache.get('t', 'b', lambda: 2)
+        cache.get('t', 'a', lambda: None)
+        cache.get('t', 'c', lambda: 3)
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.stats(), [('t', 1, 3)])
+
+
+class TestFindTags(unittest.TestCase):
+
+    def setUp(self):
+        self.content_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.content_path, 'sub'))
+        for name, text in [('a.md', u'{% notebook a.ipynb %} {% img b %}'),
+                           ('sub/b.markdown', u'{%notebook  b.ipynb%}'),
+                           ('c.rst', u'{% notebook c.ipynb %}')]:
+            with open(os.path.join(self.content_path, name), 'w') as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.content_path)
+
+    def test_markdown_content_is_scanned(self):
+        self.assertEqual(
+            sorted(mdx_liquid_tags.find_tags(self.content_path, 'notebook')),
+            [u'a.ipynb ', u'b.ipynb'])
+
+
+if __name__ == '__main__':
+    unittest.main()
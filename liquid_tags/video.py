@@ -33,7 +33,7 @@ VID_TYPEDICT = {'.mp4':"type='video/mp4; codecs=\"avc1.42E01E, mp4a.40.2\"'",
                 '.webm':"type='video/webm; codecs=vp8, vorbis'"}
 
 
-@LiquidTags.register('video')
+@LiquidTags.register('video', pure=True)
 def video(preprocessor, tag, markup):
     videos = []
     width = None
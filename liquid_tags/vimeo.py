@@ -27,7 +27,7 @@ SYNTAX = "{% vimeo id [width height] %}"
 VIMEO = re.compile(r'(\S+)(\s+(\d+)\s(\d+))?')
 
 
-@LiquidTags.register('vimeo')
+@LiquidTags.register('vimeo', pure=True)
 def vimeo(preprocessor, tag, markup):
     width = 640
     height = 390
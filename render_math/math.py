@@ -29,6 +29,7 @@ See README for more details.
 
 import os
 import sys
+import hashlib
 
 from pelican import signals
 from . pelican_mathjax_markdown_extension import PelicanMathJaxExtension
@@ -50,6 +51,7 @@ def process_settings(pelicanobj):
     mathjax_settings['process_escapes'] = 'true'  # controls whether escapes are processed
     mathjax_settings['latex_preview'] = 'TeX'  # controls what user sees while waiting for LaTex to render
     mathjax_settings['color'] = 'black'  # controls color math is rendered in
+    mathjax_settings['static_script'] = False  # controls whether the script is written once to a static file instead of inlined in each page
 
     # Source for MathJax: Works boths for http and https (see http://docs.mathjax.org/en/latest/start.html#secure-access-to-the-cdn)
     mathjax_settings['source'] = "'//cdn.mathjax.org/mathjax/latest/MathJax.js?config=TeX-AMS-MML_HTMLorMML'"
@@ -89,6 +91,9 @@ def process_settings(pelicanobj):
         if key == 'color' and isinstance(value, basestring):
             mathjax_settings[key] = value
 
+        if key == 'static_script' and isinstance(value, bool):
+            mathjax_settings[key] = value
+
     return mathjax_settings
 
 def configure_typogrify(pelicanobj, mathjax_settings):
@@ -135,6 +140,24 @@ def process_mathjax_script(mathjax_settings):
 
     return mathjax_template.format(**mathjax_settings)
 
+def mathjax_script_path(mathjax_script):
+    """Path of the static mathjax script relative to the output path. The name
+    contains a hash of the rendered script, so browsers fetch it again only
+    when the settings change"""
+
+    digest = hashlib.sha1(mathjax_script.encode('utf-8')).hexdigest()[:12]
+    return 'mathjax/mathjax-config-%s.js' % digest
+
+def process_mathjax_script_src(pelicanobj, mathjax_settings):
+    """Returns the url of the static mathjax script, or an empty string if the
+    script is inlined into each page"""
+
+    if not mathjax_settings['static_script']:
+        return ''
+
+    path = mathjax_script_path(process_mathjax_script(mathjax_settings))
+    return pelicanobj.settings.get('SITEURL', '') + '/' + path
+
 def mathjax_for_markdown(pelicanobj, mathjax_settings):
     """Instantiates a customized markdown extension for handling mathjax
     related content"""
@@ -142,6 +165,7 @@ def mathjax_for_markdown(pelicanobj, mathjax_settings):
     # Create the configuration for the markdown template
     config = {}
     config['mathjax_script'] = process_mathjax_script(mathjax_settings)
+    config['mathjax_script_src'] = process_mathjax_script_src(pelicanobj, mathjax_settings)
     config['math_tag_class'] = 'math'
 
     # Instantiate markdown extension and append it to the current extensions
@@ -155,6 +179,7 @@ def mathjax_for_markdown(pelicanobj, mathjax_settings):
 def mathjax_for_rst(pelicanobj, mathjax_settings):
     pelicanobj.settings['DOCUTILS_SETTINGS'] = {'math_output': 'MathJax'}
     rst_add_mathjax.mathjax_script = process_mathjax_script(mathjax_settings)
+    rst_add_mathjax.mathjax_script_src = process_mathjax_script_src(pelicanobj, mathjax_settings)
 
 def pelican_init(pelicanobj):
     """Loads the mathjax script according to the settings. Instantiate the Python
@@ -180,9 +205,29 @@ def rst_add_mathjax(instance):
 
     # If math class is present in text, add the javascript
     if 'class="math"' in instance._content:
-        instance._content += "<script type='text/javascript'>%s</script>" % rst_add_mathjax.mathjax_script
+        if rst_add_mathjax.mathjax_script_src:
+            instance._content += "<script type='text/javascript' src='%s'></script>" % rst_add_mathjax.mathjax_script_src
+        else:
+            instance._content += "<script type='text/javascript'>%s</script>" % rst_add_mathjax.mathjax_script
+
+def write_mathjax_script(pelicanobj):
+    """Writes the static mathjax script referenced by the pages, if enabled.
+    This is done once the site is generated, so that the file is not removed
+    by DELETE_OUTPUT_DIRECTORY"""
+
+    mathjax_settings = process_settings(pelicanobj)
+    if not mathjax_settings['static_script']:
+        return
+
+    mathjax_script = process_mathjax_script(mathjax_settings)
+    path = os.path.join(pelicanobj.settings['OUTPUT_PATH'], mathjax_script_path(mathjax_script))
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as mathjax_script_file:
+        mathjax_script_file.write(mathjax_script)
 
 def register():
     """Plugin registration"""
     signals.initialized.connect(pelican_init)
     signals.content_object_init.connect(rst_add_mathjax)
+    signals.finalized.connect(write_mathjax_script)
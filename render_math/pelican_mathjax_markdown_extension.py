@@ -46,10 +46,16 @@ class PelicanMathJaxTreeProcessor(markdown.treeprocessors.Treeprocessor):
         if (not self.pelican_mathjax_extension.mathjax_needed):
             return root
 
-        # Add the mathjax script to the html document
+        # Add the mathjax script to the html document, either as a reference
+        # to the static script or inlined
         mathjax_script = etree.Element('script')
         mathjax_script.set('type','text/javascript')
-        mathjax_script.text = AtomicString(self.pelican_mathjax_extension.getConfig('mathjax_script'))
+        mathjax_script_src = self.pelican_mathjax_extension.getConfig('mathjax_script_src')
+        if mathjax_script_src:
+            mathjax_script.set('src', mathjax_script_src)
+            mathjax_script.text = AtomicString('')
+        else:
+            mathjax_script.text = AtomicString(self.pelican_mathjax_extension.getConfig('mathjax_script'))
         root.append(mathjax_script)
 
         # Reset the boolean switch to false so that script is only added
@@ -64,11 +70,13 @@ class PelicanMathJaxExtension(markdown.Extension):
         try:
             # Needed for markdown versions >= 2.5
             self.config['mathjax_script'] = ['', 'Mathjax JavaScript script']
+            self.config['mathjax_script_src'] = ['', 'URL of the static Mathjax JavaScript script, if not inlined']
             self.config['math_tag_class'] = ['math', 'The class of the tag in which mathematics is wrapped']
             super(PelicanMathJaxExtension,self).__init__(**config)
         except AttributeError:
             # Markdown versions < 2.5
             config['mathjax_script'] = [config['mathjax_script'], 'Mathjax JavaScript script']
+            config['mathjax_script_src'] = [config['mathjax_script_src'], 'URL of the static Mathjax JavaScript script, if not inlined']
             config['math_tag_class'] = [config['math_tag_class'], 'The class of the tag in which mathematic is wrapped']
             super(PelicanMathJaxExtension,self).__init__(config)
 
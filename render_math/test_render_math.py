@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+
+from markdown.util import etree
+from pelican.tests.support import unittest
+
+from . import math
+from .pelican_mathjax_markdown_extension import (PelicanMathJaxExtension,
+                                                 PelicanMathJaxTreeProcessor)
+
+
+class Pelican(object):
+
+    def __init__(self, **settings):
+        self.settings = settings
+
+
+class Content(object):
+
+    def __init__(self, source_path, content):
+        self.source_path = source_path
+        self._content = content
+
+
+class TestStaticScript(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = tempfile.mkdtemp()
+        self.pelican = Pelican(MATH_JAX={'static_script': True},
+                               SITEURL='http://example.com',
+                               OUTPUT_PATH=self.output_path)
+        self.mathjax_settings = math.process_settings(self.pelican)
+        self.script = math.process_mathjax_script(self.mathjax_settings)
+        self.src = math.process_mathjax_script_src(self.pelican,
+                                                   self.mathjax_settings)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_path)
+
+    def test_markdown_page_references_script(self):
+        extension = PelicanMathJaxExtension({
+            'mathjax_script': self.script,
+            'mathjax_script_src': self.src,
+            'math_tag_class': 'math'})
+        extension.mathjax_needed = True
+        root = PelicanMathJaxTreeProcessor(extension).run(
+            etree.Element('div'))
+        scripts = root.findall('script')
+        self.assertEqual(len(scripts), 1)
+        self.assertEqual(scripts[0].get('src'), self.src)
+        self.assertEqual(scripts[0].text, '')
+
+    def test_rst_page_references_script(self):
+        math.mathjax_for_rst(self.pelican, self.mathjax_settings)
+        content = Content('page.rst', '<span class="math">\\(x\\)</span>')
+        math.rst_add_mathjax(content)
+        self.assertEqual(content._content,
+                         '<span class="math">\\(x\\)</span>'
+                         "<script type='text/javascript' src='%s'></script>"
+                         % self.src)
+
+    def test_script_is_written(self):
+        self.assertTrue(self.src.startswith(
+            'http://example.com/mathjax/mathjax-config-'))
+        math.write_mathjax_script(self.pelican)
+        path = os.path.join(self.output_path,
+                            self.src[len('http://example.com/'):])
+        self.assertEqual(os.listdir(os.path.dirname(path)),
+                         [os.path.basename(path)])
+        with open(path) as f:
+            self.assertEqual(f.read(), self.script)
+
+    def test_name_changes_with_settings(self):
+        pelican = Pelican(MATH_JAX={'static_script': True, 'show_menu': False},
+                          SITEURL='http://example.com')
+        src = math.process_mathjax_script_src(
+            pelican, math.process_settings(pelican))
+        self.assertNotEqual(src, self.src)
+        self.assertEqual(os.path.dirname(src), os.path.dirname(self.src))
+
+    def test_inlined_by_default(self):
+        pelican = Pelican(SITEURL='http://example.com')
+        mathjax_settings = math.process_settings(pelican)
+        self.assertEqual(
+            math.process_mathjax_script_src(pelican, mathjax_settings), '')
+        math.mathjax_for_rst(pelican, mathjax_settings)
+        content = Content('page.rst', '<span class="math">\\(x\\)</span>')
+        math.rst_add_mathjax(content)
+        self.assertIn(math.process_mathjax_script(mathjax_settings),
+                      content._content)
+        math.write_mathjax_script(Pelican(OUTPUT_PATH=self.output_path))
+        self.assertEqual(os.listdir(self.output_path), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from .tipue_search import InvertedIndexWriter, Tipue_Search_JSON_Generator
+
+
+class Category(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Page(object):
+    def __init__(self, title, content, url, category=None):
+        self.title = title
+        self.content = content
+        self.url = url
+        self.status = 'published'
+        self.translations = []
+        if category is not None:
+            self.category = Category(category)
+
+
+def read_json(*path):
+    with io.open(os.path.join(*path), encoding='utf-8') as fd:
+        return json.load(fd)
+
+
+class TipueSearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = tempfile.mkdtemp()
+        self.cache_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_path)
+        shutil.rmtree(self.cache_path)
+
+    def generate(self, pages, tpages=None, **settings):
+        """Run the generator over ``pages`` and ``tpages``
+
+        ``tpages`` maps template page names to their generated html.
+        """
+        tpages = tpages or {}
+        for name, html in tpages.items():
+            with io.open(os.path.join(self.output_path, name), 'w',
+                         encoding='utf-8') as fd:
+                fd.write(html)
+        settings.setdefault('SITEURL', 'http://example.com')
+        settings.setdefault('CACHE_PATH', self.cache_path)
+        settings['TEMPLATE_PAGES'] = dict((name, name) for name in tpages)
+        context = {'pages': [], 'articles': list(pages)}
+        generator = Tipue_Search_JSON_Generator(
+            context, settings, None, None, self.output_path)
+        generator.generate_output(None)
+        return generator
+
+
+class TestFullText(TipueSearchTestCase):
+
+    def test_output(self):
+        self.generate([Page('Apple pie', '<p>Apples &amp; pie</p>', 'a.html',
+                            'fruit')],
+                      {'search.html': '<html><title>Search</title>'
+                                      '<body>Find</body></html>'})
+        content = read_json(self.output_path, 'tipuesearch_content.json')
+        self.assertEqual(content, {'pages': [
+            {'title': 'Search', 'text': 'SearchFind', 'tags': '',
+             'loc': 'http://example.com/search.html'},
+            {'title': 'Apple pie', 'text': 'Apples & pie', 'tags': 'fruit',
+             'loc': 'http://example.com/a.html'}]})
+        self.assertFalse(os.path.exists(
+            os.path.join(self.output_path, 'tipuesearch_content.json.tmp')))
+
+    def test_failed_build_keeps_previous_output(self):
+        self.generate([Page('Apple', '<p>Apple</p>', 'a.html')])
+        broken = Page('Broken', '<p>Broken</p>', 'b.html')
+        broken.url = None  # fails while the output is streamed
+        with self.assertRaises(TypeError):
+            self.generate([Page('Pear', '<p>Pear</p>', 'p.html'), broken])
+        content = read_json(self.output_path, 'tipuesearch_content.json')
+        self.assertEqual([page['title'] for page in content['pages']],
+                         ['Apple'])
+        self.assertEqual(os.listdir(self.output_path),
+                         ['tipuesearch_content.json'])
+
+
+class TestCache(TipueSearchTestCase):
+
+    def count_extractions(self, generator_class):
+        calls = []
+        extract_page = generator_class.extract_page
+
+        def counting_extract_page(generator, page):
+            calls.append(page.url)
+            return extract_page(generator, page)
+
+        generator_class.extract_page = counting_extract_page
+        self.addCleanup(setattr, generator_class, 'extract_page',
+                        extract_page)
+        return calls
+
+    def test_unchanged_pages_are_not_parsed_again(self):
+        calls = self.count_extractions(Tipue_Search_JSON_Generator)
+        self.generate([Page('Apple', '<p>Apple</p>', 'a.html'),
+                       Page('Pear', '<p>Pear</p>', 'p.html')])
+        self.assertEqual(calls, ['a.html', 'p.html'])
+        del calls[:]
+        self.generate([Page('Apple', '<p>Apple</p>', 'a.html'),
+                       Page('Pear', '<p>Pear!</p>', 'p.html')])
+        self.assertEqual(calls, ['p.html'])
+        content = read_json(self.output_path, 'tipuesearch_content.json')
+        self.assertEqual([page['text'] for page in content['pages']],
+                         ['Apple', 'Pear!'])
+
+    def test_stale_entries_are_pruned(self):
+        self.generate([Page('Apple', '<p>Apple</p>', 'a.html'),
+                       Page('Pear', '<p>Pear</p>', 'p.html')])
+        generator = self.generate([Page('Apple', '<p>Apple</p>', 'a.html')])
+        generator.open_cache()
+        self.assertEqual(len(generator.cache), 1)
+        generator.close_cache()
+
+    def test_disabled(self):
+        calls = self.count_extractions(Tipue_Search_JSON_Generator)
+        for _ in range(2):
+            self.generate([Page('Apple', '<p>Apple</p>', 'a.html')],
+                          TIPUE_SEARCH_CACHE=False)
+        self.assertEqual(calls, ['a.html', 'a.html'])
+        self.assertEqual(os.listdir(self.cache_path), [])
+
+
+class TestInvertedIndex(TipueSearchTestCase):
+
+    def search(self, term):
+        """Look a term up like a client would, return [(loc, positions)]"""
+        index_path = os.path.join(self.output_path, 'tipuesearch_index')
+        docs = read_json(index_path, 'docs.json')
+        prefix = term[:docs['prefix_length']]
+        if prefix not in docs['shards']:
+            return []
+        postings = read_json(index_path, prefix + '.json').get(term, [])
+        return [(docs['docs'][doc_id][1], positions)
+                for doc_id, positions in postings]
+
+    def test_shard_layout(self):
+        self.generate([Page('Apple pie', '<p>Apples and apricots</p>', 'a.html'),
+                       Page('Banana', '<p>Bananas</p>', 'b.html', 'fruit')],
+                      TIPUE_SEARCH_FORMAT='index')
+        index_path = os.path.join(self.output_path, 'tipuesearch_index')
+        docs = read_json(index_path, 'docs.json')
+        self.assertEqual(docs['prefix_length'], 2)
+        self.assertEqual(docs['shards'], ['an', 'ap', 'ba', 'pi'])
+        self.assertEqual(sorted(os.listdir(index_path)),
+                         ['an.json', 'ap.json', 'ba.json', 'docs.json',
+                          'pi.json'])
+        self.assertEqual(docs['docs'],
+                         [['Apple pie', 'http://example.com/a.html', ''],
+                          ['Banana', 'http://example.com/b.html', 'fruit']])
+        self.assertEqual(sorted(read_json(index_path, 'ap.json')),
+                         ['apple', 'apples', 'apricots'])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.output_path, 'tipuesearch_content.json')))
+
+    def test_prefix_length(self):
+        self.generate([Page('Apple', '<p>Apricot</p>', 'a.html')],
+                      TIPUE_SEARCH_FORMAT='index',
+                      TIPUE_SEARCH_INDEX_PREFIX_LENGTH=3)
+        docs = read_json(self.output_path, 'tipuesearch_index', 'docs.json')
+        self.assertEqual(docs['prefix_length'], 3)
+        self.assertEqual(docs['shards'], ['app', 'apr'])
+
+    def test_query_round_trip(self):
+        self.generate([Page('Apple pie', '<p>A pie with <em>apple</em></p>',
+                            'a.html'),
+                       Page('Über', '<p>Straße pie</p>', 'b.html')],
+                      TIPUE_SEARCH_FORMAT='index')
+        self.assertEqual(self.search('apple'),
+                         [('http://example.com/a.html', [0, 5])])
+        self.assertEqual(self.search('pie'),
+                         [('http://example.com/a.html', [1, 3]),
+                          ('http://example.com/b.html', [2])])
+        self.assertEqual(self.search('straße'),
+                         [('http://example.com/b.html', [1])])
+        self.assertEqual(self.search('cherry'), [])
+
+    def test_page_without_title(self):
+        writer = InvertedIndexWriter(self.output_path, 2)
+        writer.add({'title': None, 'text': 'no title here',
+                    'tags': '', 'loc': 'http://example.com/t.html'})
+        writer.close()
+        self.assertEqual(self.search('title'),
+                         [('http://example.com/t.html', [1])])
+        docs = read_json(self.output_path, 'tipuesearch_index', 'docs.json')
+        self.assertEqual(docs['docs'][0][0], '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,8 +11,13 @@ Copyright (c) Talha Mansoor
 
 from __future__ import unicode_literals
 
-import os.path
+import os
+import re
 import json
+import hashlib
+import logging
+import shelve
+from collections import defaultdict
 from bs4 import BeautifulSoup
 from codecs import open
 try:
@@ -22,6 +27,118 @@ except ImportError:
 
 from pelican import signals
 
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def dump_json(obj, fd):
+    json.dump(obj, fd, separators=(',', ':'), ensure_ascii=False)
+
+
+def replace(src, dst):
+    """Atomically replace ``dst`` by ``src`` where the platform allows it."""
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # Python 2
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class FullTextWriter(object):
+    """Stream nodes to ``tipuesearch_content.json`` as they are created.
+
+    The nodes are written to a temporary file which only replaces the
+    output file on ``close``, so a failed build never leaves a truncated
+    JSON file behind.
+    """
+
+    def __init__(self, output_path):
+
+        self.path = os.path.join(output_path, 'tipuesearch_content.json')
+        self.tmp_path = self.path + '.tmp'
+        self.fd = open(self.tmp_path, 'w', encoding='utf-8')
+        self.fd.write('{"pages":[')
+        self.first = True
+
+
+    def add(self, node):
+
+        if not self.first:
+            self.fd.write(',')
+        self.first = False
+        dump_json(node, self.fd)
+
+
+    def close(self):
+
+        self.fd.write(']}')
+        self.fd.close()
+        replace(self.tmp_path, self.path)
+
+
+    def abort(self):
+
+        self.fd.close()
+        os.remove(self.tmp_path)
+
+
+class InvertedIndexWriter(object):
+    """Write a tokenized inverted index sharded by term prefix.
+
+    ``tipuesearch_index/docs.json`` holds the document table and the
+    list of shards; every ``tipuesearch_index/<prefix>.json`` shard maps
+    each term starting with ``<prefix>`` to ``[[doc_id, [positions]]]``.
+    Only the postings are kept in memory, not the text of the pages.
+    """
+
+    def __init__(self, output_path, prefix_length):
+
+        self.index_path = os.path.join(output_path, 'tipuesearch_index')
+        if not os.path.isdir(self.index_path):
+            os.makedirs(self.index_path)
+        self.prefix_length = prefix_length
+        self.docs = []
+        self.shards = defaultdict(lambda: defaultdict(list))
+
+
+    def add(self, node):
+
+        doc_id = len(self.docs)
+        # template pages without a <title> have no title
+        title = node['title'] or ''
+        self.docs.append([title, node['loc'], node['tags']])
+        positions = defaultdict(list)
+        text = title + ' ' + node['text']
+        for position, match in enumerate(TOKEN_RE.finditer(text)):
+            positions[match.group().lower()].append(position)
+        for term, term_positions in positions.items():
+            prefix = term[:self.prefix_length]
+            self.shards[prefix][term].append([doc_id, term_positions])
+
+
+    def write(self, name, obj):
+
+        with open(os.path.join(self.index_path, name), 'w', encoding='utf-8') as fd:
+            dump_json(obj, fd)
+
+
+    def close(self):
+
+        for prefix, terms in self.shards.items():
+            self.write(prefix + '.json', terms)
+
+        self.write('docs.json', {'prefix_length': self.prefix_length,
+                                 'shards': sorted(self.shards),
+                                 'docs': self.docs})
+
+
+    def abort(self):
+        # nothing is written before close
+        pass
+
 
 class Tipue_Search_JSON_Generator(object):
 
@@ -32,13 +149,67 @@ class Tipue_Search_JSON_Generator(object):
         self.siteurl = settings.get('SITEURL')
         self.tpages = settings.get('TEMPLATE_PAGES')
         self.output_path = output_path
-        self.json_nodes = []
+        self.search_format = settings.get('TIPUE_SEARCH_FORMAT', 'json')
+        self.prefix_length = settings.get('TIPUE_SEARCH_INDEX_PREFIX_LENGTH', 2)
+        self.cache_file = None
+        if settings.get('TIPUE_SEARCH_CACHE', True):
+            self.cache_file = os.path.join(settings.get('CACHE_PATH', 'cache'),
+                                           'tipuesearch_nodes')
+        self.cache = None
+        self.used_cache = set()
 
 
-    def create_json_node(self, page):
+    def open_cache(self):
+        """Open the on disk node cache
 
-        if getattr(page, 'status', 'published') != 'published':
+        The cache is a shelf, so cached text is read page by page instead
+        of loading the text of the whole site into memory.
+        """
+
+        if self.cache_file is None:
             return
+        cache_dir = os.path.dirname(self.cache_file)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        try:
+            self.cache = shelve.open(self.cache_file, protocol=2)
+        except Exception as e:
+            logger.warning('tipue_search: recreating unreadable cache %s: %s',
+                           self.cache_file, e)
+            self.cache = shelve.open(self.cache_file, flag='n', protocol=2)
+
+
+    def close_cache(self):
+
+        if self.cache is None:
+            return
+        # only keep the entries of this build so stale pages do not pile up
+        for digest in set(self.cache.keys()) - self.used_cache:
+            del self.cache[digest]
+        self.cache.close()
+        self.cache = None
+
+
+    def cached_title_text(self, digest, extract, *args):
+        """Return the (title, text) pair cached under ``digest``
+
+        ``extract(*args)`` is only called when the digest is unknown.
+        """
+
+        if self.cache is None:
+            return extract(*args)
+        # shelve keys must be native strings, i.e. bytes on Python 2
+        digest = str(digest)
+        if digest in self.cache:
+            title, text = self.cache[digest]
+        else:
+            title, text = extract(*args)
+            self.cache[digest] = (title, text)
+        self.used_cache.add(digest)
+        return title, text
+
+
+    def extract_page(self, page):
 
         soup_title = BeautifulSoup(page.title.replace('&nbsp;', ' '))
         page_title = soup_title.get_text(' ', strip=True).replace('“', '"').replace('”', '"').replace('’', "'").replace('^', '&#94;')
@@ -47,6 +218,35 @@ class Tipue_Search_JSON_Generator(object):
         page_text = soup_text.get_text(' ', strip=True).replace('“', '"').replace('”', '"').replace('’', "'").replace('¶', ' ').replace('^', '&#94;')
         page_text = ' '.join(page_text.split())
 
+        return page_title, page_text
+
+
+    def extract_tpage(self, source):
+
+        soup = BeautifulSoup(source, 'html.parser')
+        page_text = soup.get_text()
+
+        # What happens if there is not a title.
+        if soup.title is not None:
+            page_title = soup.title.get_text()
+        else:
+            page_title = ''
+
+        return page_title, page_text
+
+
+    def create_json_node(self, page):
+
+        if getattr(page, 'status', 'published') != 'published':
+            return
+
+        digest = hashlib.sha1()
+        digest.update(page.content.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(page.title.encode('utf-8'))
+        page_title, page_text = self.cached_title_text(
+            'page:' + digest.hexdigest(), self.extract_page, page)
+
         if getattr(page, 'category', 'None') == 'None':
             page_category = ''
         else:
@@ -59,20 +259,16 @@ class Tipue_Search_JSON_Generator(object):
                 'tags': page_category,
                 'loc': page_url}
 
-        self.json_nodes.append(node)
+        return node
 
 
     def create_tpage_node(self, srclink):
 
-        srcfile = open(os.path.join(self.output_path, self.tpages[srclink]))
-        soup = BeautifulSoup(srcfile, 'html.parser')
-        page_text = soup.get_text()
-
-        # What happens if there is not a title.
-        if soup.title is not None:
-            page_title = soup.title.string
-        else:
-            page_title = ''
+        with open(os.path.join(self.output_path, self.tpages[srclink]), 'rb') as srcfile:
+            source = srcfile.read()
+        digest = 'tpage:' + hashlib.sha1(source).hexdigest()
+        page_title, page_text = self.cached_title_text(
+            digest, self.extract_tpage, source)
 
         # Should set default category?
         page_category = ''
@@ -83,27 +279,38 @@ class Tipue_Search_JSON_Generator(object):
                 'text': page_text,
                 'tags': page_category,
                 'loc': page_url}
-        
-        self.json_nodes.append(node)
+
+        return node
 
 
     def generate_output(self, writer):
-        path = os.path.join(self.output_path, 'tipuesearch_content.json')
 
         pages = self.context['pages'] + self.context['articles']
 
         for article in self.context['articles']:
             pages += article.translations
 
-        for srclink in self.tpages:
-            self.create_tpage_node(srclink)
-
-        for page in pages:
-            self.create_json_node(page)
-        root_node = {'pages': self.json_nodes}
-
-        with open(path, 'w', encoding='utf-8') as fd:
-            json.dump(root_node, fd, separators=(',', ':'), ensure_ascii=False)
+        self.open_cache()
+        if self.search_format == 'index':
+            output = InvertedIndexWriter(self.output_path, self.prefix_length)
+        else:
+            output = FullTextWriter(self.output_path)
+
+        try:
+            for srclink in self.tpages:
+                output.add(self.create_tpage_node(srclink))
+
+            for page in pages:
+                node = self.create_json_node(page)
+                if node is not None:
+                    output.add(node)
+        except BaseException:
+            output.abort()
+            raise
+        else:
+            output.close()
+        finally:
+            self.close_cache()
 
 
 def get_generators(generators):